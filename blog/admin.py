@@ -1,5 +1,40 @@
-from django.contrib import admin
-from .models import Post, Comment
+from django.contrib import admin, messages
+from django.contrib.postgres.search import SearchQuery
+from django.db import transaction
+from django.db.models import Q
+from .cache import bump_version
+from .counters import recount_comments
+from .models import ArchiveMonth, Post, Comment, QueuedEmail
+from .pagecache import detail_group
+from .pagination import EstimatedCountPaginator
+from .sitemaps import month_range, valid_month
+
+
+class ArchiveMonthFilter(admin.SimpleListFilter):
+    '''
+    Фильтр по месяцу публикации вместо date_hierarchy: месяцы берутся
+    из ArchiveMonth, а не из DISTINCT по датам всей таблицы статей.
+    '''
+    title = 'publish month'
+    parameter_name = 'month'
+
+    def lookups(self, request, model_admin):
+        return [('{}-{}'.format(month.year, month.month), month.date.strftime('%B %Y'))
+                for month in ArchiveMonth.objects.filter(published_count__gt=0)]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            year, month = (int(part) for part in self.value().split('-'))
+        except ValueError:
+            return queryset.none()
+        # month_range отвечает 404 на несуществующий месяц
+        if not valid_month(year, month):
+            return queryset.none()
+        start, end = month_range(year, month)
+        return queryset.filter(publish__gte=start, publish__lt=end)
+
 
 # регистрируем декодируемый класс - наследник Model.Admin
 @admin.register(Post)
@@ -10,18 +45,72 @@ class PostAdmin(admin.ModelAdmin):
     search_fields - строка поиска по полям
     prepopulated_fields - генерация slug из поля title
     raw_id_fields -
+    Количество строк в списке оценивается (EstimatedCountPaginator),
+    поиск идет по search_vector и триграммному индексу заголовков.
     '''
     list_display = ('title', 'slug', 'author', 'publish','status')
-    list_filter = ('status', 'created', 'publish', 'author')
-    search_fields = ('title', 'body')
+    list_filter = ('status', ArchiveMonthFilter, 'author')
+    search_fields = ('title',)
     prepopulated_fields = {'slug': ('title',)}
     raw_id_fields = ('author',)
-    date_hierarchy = 'publish'
     ordering = ('status', 'publish')
+    list_select_related = ('author',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        '''Полнотекстовый поиск по индексу вместо ILIKE по тексту статьи'''
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(Q(search_vector=SearchQuery(search_term)) |
+                               Q(title__icontains=search_term)), False
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
+    '''
+    Поиск только по имени и email: ILIKE по тексту комментариев
+    обходит всю таблицу. Модерация - действиями над выбранными
+    комментариями, одним UPDATE.
+    '''
     list_display = ('name', 'email', 'post', 'created', 'active')
-    list_filter = ('active', 'created', 'updated')
-    search_fields = ('name', 'email', 'body')
+    list_filter = ('active', 'created')
+    search_fields = ('name', 'email')
+    raw_id_fields = ('post',)
+    list_select_related = ('post',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('approve_comments', 'disable_comments')
+
+    def set_active(self, request, queryset, active):
+        '''
+        Одним UPDATE меняет активность комментариев. Сигналы при этом не
+        вызываются, поэтому счетчики статей пересчитываются, а кэш
+        страниц сбрасывается здесь же.
+        '''
+        with transaction.atomic():
+            changed = queryset.exclude(active=active)
+            post_ids = set(changed.values_list('post_id', flat=True).distinct())
+            count = changed.update(active=active)
+            recount_comments(post_ids)
+            for post in Post.objects.filter(id__in=post_ids).only('publish', 'slug'):
+                bump_version(detail_group(post.publish, post.slug))
+            bump_version('sidebar')
+        return count
+
+    def approve_comments(self, request, queryset):
+        count = self.set_active(request, queryset, True)
+        self.message_user(request, '{} comments approved.'.format(count), messages.SUCCESS)
+    approve_comments.short_description = 'Approve selected comments'
+
+    def disable_comments(self, request, queryset):
+        count = self.set_active(request, queryset, False)
+        self.message_user(request, '{} comments disabled.'.format(count), messages.SUCCESS)
+    disable_comments.short_description = 'Disable selected comments'
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'next_attempt', 'sent')
+    list_filter = ('status',)
+    search_fields = ('to',)
 # Register your models here.
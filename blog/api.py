@@ -0,0 +1,206 @@
+'''
+Версия 1 JSON API для опубликованных статей, тегов и комментариев.
+Поля ответа выбираются параметром ?fields=, из БД читаются только
+нужные колонки. Списки статей разбиты на страницы курсором (publish, id),
+ответы поддерживают условные запросы по ETag. Last-Modified не отдается:
+счетчик комментариев и теги меняются без изменения Post.updated.
+'''
+import functools
+import hashlib
+import json
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import prefetch_related_objects
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+from .models import Post, Comment, TagStat
+from .pagination import CursorPaginator
+from .transfer import chunked
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+STREAM_CHUNK_SIZE = 500
+
+# Поле ответа: (колонки модели, которые нужно прочитать; значение)
+POST_FIELDS = {
+    'id': ((), lambda post, request: post.id),
+    'title': (('title',), lambda post, request: post.title),
+    'slug': (('slug',), lambda post, request: post.slug),
+    'url': (('slug',), lambda post, request: request.build_absolute_uri(post.get_absolute_url())),
+    'author': (('author__username',), lambda post, request: post.author.username),
+    'publish': ((), lambda post, request: post.publish.isoformat()),
+    'updated': (('updated',), lambda post, request: post.updated.isoformat()),
+    'excerpt': (('excerpt',), lambda post, request: post.excerpt),
+    'body': (('body',), lambda post, request: post.body),
+    'body_html': (('body_html',), lambda post, request: post.body_html),
+    'comments_count': (('comments_count',), lambda post, request: post.comments_count),
+    'tags': ((), lambda post, request: [tag.name for tag in post.tags.all()]),
+}
+# Тексты статей в списках только по явному запросу
+LIST_FIELDS = [name for name in POST_FIELDS if name not in ('body', 'body_html')]
+
+
+class ApiError(Exception):
+    '''Ошибка в параметрах запроса, ответ 400'''
+
+
+def api_view(view):
+    '''Только GET/HEAD; ошибки параметров и 404 отдаются в JSON'''
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        except Http404:
+            return JsonResponse({'error': 'Not found'}, status=404)
+    return require_safe(wrapper)
+
+
+def parse_fields(request, default):
+    if not request.GET.get('fields'):
+        return default
+    fields = [name.strip() for name in request.GET['fields'].split(',') if name.strip()]
+    unknown = [name for name in fields if name not in POST_FIELDS]
+    if unknown:
+        raise ApiError('Unknown fields: {}'.format(', '.join(unknown)))
+    return fields
+
+
+def parse_limit(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be an integer')
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def post_queryset(fields, prefetch=True):
+    '''Опубликованные статьи только с колонками для выбранных полей'''
+    # id и publish нужны всегда: это ключ курсора
+    columns = {'id', 'publish'}
+    for name in fields:
+        columns.update(POST_FIELDS[name][0])
+    queryset = Post.published.only(*columns)
+    if 'author' in fields:
+        queryset = queryset.select_related('author')
+    if 'tags' in fields and prefetch:
+        queryset = queryset.prefetch_related('tags')
+    return queryset
+
+
+def serialize_post(post, fields, request):
+    return {name: POST_FIELDS[name][1](post, request) for name in fields}
+
+
+def page_url(request, cursor):
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri('?' + query.urlencode())
+
+
+def post_etag(request, post_id):
+    '''
+    ETag статьи по всему, что попадает в ответ: время изменения,
+    счетчик комментариев и теги (один запрос).
+    '''
+    state = Post.published.filter(id=post_id).order_by()\
+        .annotate(tag_names=ArrayAgg('tags__name', ordering='tags__name'))\
+        .values('updated', 'comments_count', 'tag_names').first()
+    if state is None:
+        return None
+    return hashlib.md5('{}-{}-{}-{}'.format(
+        post_id, state['updated'].timestamp(), state['comments_count'],
+        json.dumps(state['tag_names'])).encode()).hexdigest()
+
+
+@api_view
+def post_list(request):
+    '''
+    Статьи по убыванию даты публикации: ?fields=, ?tag=, ?limit=, ?cursor=.
+    ETag по телу ответа ставит ConditionalGetMiddleware: состояние страницы
+    (счетчики и теги всех статей) дешевле всего узнать, собрав ее.
+    '''
+    fields = parse_fields(request, LIST_FIELDS)
+    queryset = post_queryset(fields)
+    if request.GET.get('tag'):
+        queryset = queryset.filter(tags__slug=request.GET['tag'])
+    page = CursorPaginator(queryset, parse_limit(request)).page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [serialize_post(post, fields, request) for post in page],
+        'next': page_url(request, page.next_cursor) if page.has_next() else None,
+        'previous': page_url(request, page.previous_cursor) if page.has_previous() else None,
+    })
+
+
+@api_view
+@condition(etag_func=post_etag)
+def post_detail(request, post_id):
+    fields = parse_fields(request, list(POST_FIELDS))
+    post = get_object_or_404(post_queryset(fields), id=post_id)
+    return JsonResponse(serialize_post(post, fields, request))
+
+
+@api_view
+def post_comments(request, post_id):
+    '''Активные комментарии статьи по порядку: ?after=<id>, ?limit='''
+    if not Post.published.filter(id=post_id).exists():
+        raise Http404
+    limit = parse_limit(request)
+    comments = Comment.objects.filter(post_id=post_id, active=True).order_by('id')
+    if request.GET.get('after'):
+        try:
+            comments = comments.filter(id__gt=int(request.GET['after']))
+        except ValueError:
+            raise ApiError('after must be an integer')
+    comments = list(comments.values('id', 'name', 'body', 'created')[:limit + 1])
+    next_url = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        query = request.GET.copy()
+        query['after'] = comments[-1]['id']
+        next_url = request.build_absolute_uri('?' + query.urlencode())
+    for comment in comments:
+        comment['created'] = comment['created'].isoformat()
+    return JsonResponse({'results': comments, 'next': next_url})
+
+
+@api_view
+def tag_list(request):
+    '''Теги с количеством опубликованных статей (из TagStat)'''
+    stats = TagStat.objects.filter(published_count__gt=0).select_related('tag')\
+        .order_by('-published_count', 'tag__name')
+    return JsonResponse({'results': [{'name': stat.tag.name, 'slug': stat.tag.slug,
+                                      'count': stat.published_count} for stat in stats]})
+
+
+@api_view
+def post_stream(request):
+    '''
+    Все опубликованные статьи в NDJSON (одна статья в строке) для
+    массовой выгрузки. Строки читаются серверным курсором PostgreSQL
+    (iterator), теги подгружаются одним запросом на пачку, поэтому
+    память не зависит от количества статей.
+    Под ASGI Django 3.1 перебирает потоковый ответ в цикле событий, где
+    запросы к БД запрещены, а асинхронные итераторы не поддерживаются.
+    Поэтому там выгрузка отвечает 406 и предлагает команду export_posts.
+    '''
+    if isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Streaming export is not available under ASGI, '
+                                      'use "manage.py export_posts" or the WSGI server'},
+                            status=406)
+    fields = parse_fields(request, LIST_FIELDS)
+    queryset = post_queryset(fields, prefetch=False).order_by('id')
+    # БД выбирается сейчас: ответ читается уже после middleware роутера
+    queryset = queryset.using(queryset.db)
+
+    def lines():
+        for chunk in chunked(queryset.iterator(chunk_size=STREAM_CHUNK_SIZE), STREAM_CHUNK_SIZE):
+            if 'tags' in fields:
+                prefetch_related_objects(chunk, 'tags')
+            for post in chunk:
+                yield json.dumps(serialize_post(post, fields, request)) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
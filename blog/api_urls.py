@@ -0,0 +1,12 @@
+from django.urls import path
+from . import api
+app_name = 'api'
+
+# Подключается в yoga/urls.py с префиксом версии: /api/v1/
+urlpatterns = [
+    path('posts/', api.post_list, name='post_list'),
+    path('posts.ndjson', api.post_stream, name='post_stream'),
+    path('posts/<int:post_id>/', api.post_detail, name='post_detail'),
+    path('posts/<int:post_id>/comments/', api.post_comments, name='post_comments'),
+    path('tags/', api.tag_list, name='tag_list'),
+]
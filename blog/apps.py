@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    def ready(self):
+        # Регистрируем обработчики сигналов
+        from . import signals  # noqa: F401
+        # Обертка SQL запросов ставится на каждое новое соединение
+        from . import instrumentation  # noqa: F401
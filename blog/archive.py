@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest, TruncMonth
+from django.utils import timezone
+from .models import ArchiveMonth, Post
+
+
+def month_of(publish):
+    '''(год, месяц) даты публикации в текущей зоне'''
+    publish = timezone.localtime(publish)
+    return publish.year, publish.month
+
+
+def change_month_count(year, month, delta):
+    '''Атомарно меняет количество статей месяца на delta'''
+    ArchiveMonth.objects.bulk_create([ArchiveMonth(year=year, month=month)],
+                                     ignore_conflicts=True)
+    ArchiveMonth.objects.filter(year=year, month=month)\
+        .update(published_count=Greatest(F('published_count') + delta, 0))
+
+
+def recount_archive():
+    '''Пересчитывает все месяцы группировкой статей по месяцу публикации'''
+    months = Post.published.annotate(month=TruncMonth('publish')).order_by()\
+        .values('month').annotate(n=Count('id')).values_list('month', 'n')
+    with transaction.atomic():
+        ArchiveMonth.objects.all().delete()
+        archive = ArchiveMonth.objects.bulk_create(
+            [ArchiveMonth(year=month.year, month=month.month, published_count=n)
+             for month, n in months])
+    return len(archive)
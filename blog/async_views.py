@@ -0,0 +1,139 @@
+'''
+Асинхронные версии обработчиков чтения для работы под ASGI.
+ORM в Django синхронный, поэтому запросы выполняются в потоках, но
+независимые запросы (комментарии, похожие статьи, боковая панель)
+идут параллельно в потоках DB_THREADS, каждый со своим соединением с БД.
+'''
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import views
+from .conditions import post_detail_etag, post_detail_last_modified
+from .feeds import latest_posts_feed
+from .forms import CommentForm, SearchForm
+from .models import Post
+from .templatetags.blog_tags import (get_most_commented_posts, show_archive,
+                                     show_latest_posts, show_tag_cloud, total_post)
+
+# Потоки для параллельных запросов к БД. Их немного и они живут все время
+# процесса. Соединения потоков подчиняются тем же правилам, что и
+# соединения потоков запросов: CONN_MAX_AGE и закрытие сломанных соединений.
+DB_THREADS = ThreadPoolExecutor(max_workers=settings.BLOG_ASYNC_DB_THREADS,
+                                thread_name_prefix='blog-db')
+
+
+def in_thread(func):
+    '''Запускает func в потоке DB_THREADS, параллельно с другими такими вызовами'''
+    def run(*args, **kwargs):
+        # Как request_started и request_finished для потока запроса
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def call(*args, **kwargs):
+        # Контекст (например, разрешение читать с реплики) передается в поток
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            DB_THREADS, functools.partial(context.run, run, *args, **kwargs))
+    return call
+
+
+def close_thread_connections():
+    '''Закрывает соединения всех потоков DB_THREADS (тесты, остановка процесса)'''
+    workers = DB_THREADS._max_workers
+    # Барьер не дает одному потоку выполнить две задачи
+    barrier = threading.Barrier(workers)
+
+    def close():
+        barrier.wait()
+        connections.close_all()
+    for future in [DB_THREADS.submit(close) for _ in range(workers)]:
+        future.result()
+
+
+# Рендеринг и все, что связано с запросом пользователя, выполняется
+# в потоке запроса с его обычным соединением
+in_request_thread = lambda func: sync_to_async(func, thread_sensitive=True)
+
+
+def warm_sidebar():
+    '''Заполняет кэши боковой панели, чтобы рендеринг base.html не ждал БД'''
+    total_post()
+    show_latest_posts(3)
+    get_most_commented_posts()
+    show_archive(12)
+    show_tag_cloud(20)
+
+
+async def post_list(request, tag_slug=None):
+    context, _ = await asyncio.gather(
+        in_thread(views.post_list_context)(request, tag_slug),
+        in_thread(warm_sidebar)())
+    return await in_request_thread(render)(request, 'blog/post/list.html', context)
+
+
+async def post_detail(request, year, month, day, post):
+    if request.method not in ('GET', 'HEAD'):
+        # Добавление комментария обрабатывает синхронная версия
+        return await in_request_thread(views.post_detail)(request, year, month, day, post)
+
+    def validators():
+        return (post_detail_etag(request, year, month, day, post),
+                post_detail_last_modified(request, year, month, day, post))
+
+    etag, last_modified = await in_request_thread(validators)()
+    etag = quote_etag(etag) if etag else None
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    post = await in_request_thread(get_object_or_404)(
+        Post.published.by_date(year, month, day, post))
+    comments, similar_posts, _ = await asyncio.gather(
+        in_thread(list)(post.comments.filter(active=True)),
+        in_thread(list)(views.similar_posts_for(post)),
+        in_thread(warm_sidebar)())
+    response = await in_request_thread(render)(
+        request, 'blog/post/detail.html', {'post': post,
+                                           'comments': comments,
+                                           'new_comment': None,
+                                           'comment_form': CommentForm(),
+                                           'similar_posts': similar_posts})
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+async def post_search(request):
+    form = SearchForm()
+    query = None
+    results = []
+    if 'query' in request.GET:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data['query']
+            results, _ = await asyncio.gather(
+                in_thread(views.search_results)(query, request.GET.get('page')),
+                in_thread(warm_sidebar)())
+    return await in_request_thread(render)(request, 'blog/post/search.html',
+                                           {'form': form,
+                                            'query': query,
+                                            'results': results})
+
+
+async def post_feed(request):
+    return await in_request_thread(latest_posts_feed)(request)
@@ -0,0 +1,142 @@
+'''Общие функции для команд измерения производительности'''
+import asyncio
+import io
+import itertools
+import math
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values, fraction):
+    '''Перцентиль методом ближайшего ранга, fraction от 0 до 1'''
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, queries=None, statuses=None):
+    '''
+    Сводка по задержкам (в секундах) и общему времени прогона.
+    queries - количество SQL запросов из заголовка Server-Timing,
+    statuses - коды ответов.
+    '''
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+    summary = {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+    }
+    queries = [count for count in queries or () if count is not None]
+    if queries:
+        summary['queries_mean'] = round(sum(queries) / len(queries), 2)
+        summary['queries_max'] = max(queries)
+    if statuses:
+        summary['statuses'] = {str(code): statuses.count(code) for code in sorted(set(statuses))}
+    return summary
+
+
+def query_count(headers):
+    '''Количество SQL запросов из Server-Timing (см. RequestTimingMiddleware)'''
+    for name, value in headers:
+        if name.lower() == 'server-timing':
+            match = SERVER_TIMING_QUERIES.search(value)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+def run_wsgi(paths, count, concurrency, host='localhost'):
+    '''
+    count GET запросов по кругу по paths прямо в WSGI приложение Django,
+    concurrency потоков одновременно. Возвращает summarize().
+    '''
+    application = get_wsgi_application()
+    urls = itertools.cycle([urlsplit(path) for path in paths])
+    jobs = [next(urls) for _ in range(count)]
+
+    def request(url):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path,
+            'QUERY_STRING': url.query, 'SERVER_NAME': host,
+            'SERVER_PORT': '80', 'HTTP_HOST': host,
+            'SCRIPT_NAME': '', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0),
+            'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result['status'] = int(status.split()[0])
+            result['headers'] = headers
+
+        start = time.perf_counter()
+        response = application(environ, start_response)
+        b''.join(response)
+        response.close()
+        return (time.perf_counter() - start, result['status'],
+                query_count(result['headers']))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(request, jobs))
+    elapsed = time.perf_counter() - started
+    return summarize([r[0] for r in results], elapsed,
+                     [r[2] for r in results], [r[1] for r in results])
+
+
+def run_asgi(paths, count, concurrency, host='localhost'):
+    '''То же, что run_wsgi, но через ASGI приложение и asyncio'''
+    application = get_asgi_application()
+    urls = itertools.cycle([urlsplit(path) for path in paths])
+    jobs = [next(urls) for _ in range(count)]
+
+    async def request(url, semaphore):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': url.path,
+            'raw_path': url.path.encode(), 'query_string': url.query.encode(),
+            'root_path': '', 'headers': [(b'host', host.encode())],
+            'client': ('127.0.0.1', 0), 'server': (host, 80),
+        }
+        result = {}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                result['status'] = message['status']
+                result['headers'] = [(name.decode('latin-1'), value.decode('latin-1'))
+                                     for name, value in message['headers']]
+
+        async with semaphore:
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            return (time.perf_counter() - start, result['status'],
+                    query_count(result['headers']))
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(url, semaphore) for url in jobs))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return summarize([r[0] for r in results], elapsed,
+                     [r[2] for r in results], [r[1] for r in results])
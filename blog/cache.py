@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def blog_cache():
+    '''Кэш блога, алиас задается настройкой BLOG_CACHE_ALIAS'''
+    return caches[getattr(settings, 'BLOG_CACHE_ALIAS', 'default')]
+
+
+def version_key(namespace):
+    return 'blog:version:{}'.format(namespace)
+
+
+def get_version(namespace):
+    '''
+    Текущая версия пространства имен кэша. Счетчик хранится в самом кэше,
+    поэтому при общем бэкенде его видят все процессы. Начальное значение
+    берется от времени, чтобы после вытеснения счетчика не вернуться
+    к версии, под которой еще лежат старые данные.
+    '''
+    cache = blog_cache()
+    key = version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _incr_version(namespace):
+    cache = blog_cache()
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        # Счетчика еще нет или он вытеснен
+        get_version(namespace)
+
+
+def bump_version(namespace):
+    '''
+    Делает недействительными все записи пространства имен.
+    Версия увеличивается сразу и еще раз после фиксации транзакции:
+    иначе другой процесс мог бы успеть закэшировать старые данные
+    под новой версией.
+    '''
+    _incr_version(namespace)
+    transaction.on_commit(lambda: _incr_version(namespace))
+
+
+def get_or_set(namespace, key, compute, timeout=None):
+    '''Значение из кэша под текущей версией namespace или результат compute()'''
+    if timeout is None:
+        timeout = getattr(settings, 'BLOG_CACHE_TIMEOUT', 60 * 60)
+    return blog_cache().get_or_set('blog:{}:{}'.format(namespace, key), compute,
+                                   timeout, version=get_version(namespace))
@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .cache import blog_cache
+from .models import Post
+
+# Время, когда статья последний раз пропала из опубликованных
+REMOVED_KEY = 'blog:posts:removed'
+
+
+def mark_post_removed():
+    '''
+    Статья удалена или снята с публикации. MAX(updated) опубликованных
+    статей от этого не растет, поэтому время запоминается отдельно
+    (сразу и еще раз после фиксации транзакции).
+    '''
+    blog_cache().set(REMOVED_KEY, timezone.now(), None)
+    transaction.on_commit(lambda: blog_cache().set(REMOVED_KEY, timezone.now(), None))
+
+
+def with_removals(latest):
+    '''
+    Время изменения списка статей с учетом удалений. Если отметка
+    вытеснена из кэша, считаем, что статья пропала только что.
+    '''
+    cache = blog_cache()
+    removed = cache.get(REMOVED_KEY)
+    if removed is None:
+        cache.add(REMOVED_KEY, timezone.now(), None)
+        removed = cache.get(REMOVED_KEY)
+    return max(latest, removed) if latest else removed
+
+
+def latest_post_modified(request, *args, **kwargs):
+    '''
+    Время последнего изменения опубликованных статей (RSS, индекс карты
+    сайта). Черновики не учитываются, удаление и снятие с публикации -
+    учитываются. MAX по индексу blog_post_updated_idx - одно чтение индекса.
+    '''
+    return with_removals(Post.published.aggregate(latest=Max('updated'))['latest'])
+
+
+def post_detail_state(request, year, month, day, post):
+    '''
+    Данные для валидаторов страницы статьи: время изменения статьи,
+    счетчик и время последнего комментария. Запрос выполняется один раз
+    за запрос пользователя, результат хранится в request.
+    '''
+    if not hasattr(request, '_post_detail_state'):
+        request._post_detail_state = Post.published.by_date(year, month, day, post)\
+            .order_by().annotate(last_comment=Max('comments__created'))\
+            .values('id', 'updated', 'comments_count', 'last_comment').first()
+    return request._post_detail_state
+
+
+def post_detail_last_modified(request, *args, **kwargs):
+    state = post_detail_state(request, *args, **kwargs)
+    if state is None:
+        return None
+    if state['last_comment'] and state['last_comment'] > state['updated']:
+        return state['last_comment']
+    return state['updated']
+
+
+def post_detail_etag(request, *args, **kwargs):
+    '''
+    ETag учитывает счетчик активных комментариев: скрытие комментария
+    не меняет времена, но меняет страницу.
+    '''
+    state = post_detail_state(request, *args, **kwargs)
+    if state is None:
+        return None
+    last_comment = state['last_comment'].timestamp() if state['last_comment'] else 0
+    return '{}-{}-{}-{}'.format(state['id'], state['updated'].timestamp(),
+                                state['comments_count'], last_comment)
@@ -0,0 +1,32 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Post, Comment
+
+
+def change_comments_count(post_id, delta):
+    '''Атомарно меняет счетчик комментариев статьи на delta'''
+    Post.objects.filter(pk=post_id).update(comments_count=F('comments_count') + delta)
+
+
+def active_comments_subquery():
+    '''Количество активных комментариев статьи из внешнего запроса'''
+    return Subquery(Comment.objects.filter(post=OuterRef('pk'), active=True)
+                    .order_by().values('post').annotate(n=Count('id')).values('n'))
+
+
+def recount_comments(post_ids=None):
+    '''
+    Пересчитывает comments_count одним UPDATE с подзапросом.
+    Без post_ids - для всех статей. Возвращает число обновленных строк.
+    '''
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(id__in=post_ids)
+    return posts.update(comments_count=Coalesce(active_comments_subquery(), 0))
+
+
+def drifted_posts():
+    '''Статьи, у которых счетчик не совпадает с реальным количеством'''
+    return Post.objects.annotate(
+        actual=Coalesce(active_comments_subquery(), 0)
+    ).exclude(comments_count=F('actual'))
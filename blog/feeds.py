@@ -1,5 +1,7 @@
 from django.contrib.syndication.views import Feed
 from django.template.defaultfilters import truncatewords
+from django.views.decorators.http import condition
+from .conditions import latest_post_modified
 from .models import Post
 
 class LatestPostsFeed(Feed):
@@ -14,4 +16,8 @@ class LatestPostsFeed(Feed):
         return item.title
 
     def item_description(self, item):
-        return truncatewords(item.body, 30)
\ No newline at end of file
+        return truncatewords(item.body, 30)
+
+
+# Обработчик RSS с ответом 304 по Last-Modified
+latest_posts_feed = condition(last_modified_func=latest_post_modified)(LatestPostsFeed())
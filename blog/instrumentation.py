@@ -0,0 +1,109 @@
+'''
+Учет SQL запросов и времени рендеринга шаблонов для каждого запроса.
+Работает без DEBUG: обертка execute ставится на каждое новое соединение
+(сигнал connection_created) и ничего не делает вне запроса.
+'''
+import contextvars
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template import TemplateDoesNotExist
+
+logger = logging.getLogger('blog.perf')
+
+_current = contextvars.ContextVar('blog_request_stats', default=None)
+
+
+class RequestStats:
+    '''Счетчики одного запроса. Могут пополняться из нескольких потоков'''
+
+    def __init__(self, keep_slowest=3):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.slowest = []
+        self.keep_slowest = keep_slowest
+        self.lock = threading.Lock()
+
+    def add_query(self, sql, duration):
+        with self.lock:
+            self.queries += 1
+            self.sql_time += duration
+            item = (duration, sql)
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, item)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def add_template(self, duration):
+        with self.lock:
+            self.template_time += duration
+
+
+def current_stats():
+    return _current.get()
+
+
+def start_request():
+    stats = RequestStats(getattr(settings, 'BLOG_SLOW_QUERY_COUNT', 3))
+    _current.set(stats)
+    return stats
+
+
+def finish_request():
+    _current.set(None)
+
+
+def query_timer(execute, sql, params, many, context):
+    '''Обертка execute: время и текст запроса в статистику текущего запроса'''
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class InstrumentedTemplate(Template):
+    '''
+    Шаблон, время рендеринга которого попадает в статистику запроса.
+    Вложенные шаблоны (include, inclusion_tag) рендерятся внутри и
+    отдельно не учитываются. В это время входят и запросы из шаблонов.
+    '''
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.add_template(time.perf_counter() - start)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    '''Бэкенд шаблонов Django, возвращающий InstrumentedTemplate'''
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
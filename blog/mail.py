@@ -0,0 +1,115 @@
+import smtplib
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import QueuedEmail
+
+# После стольких неудачных попыток письмо помечается как failed
+MAX_ATTEMPTS = 5
+# Задержка перед повтором: 1, 2, 4, 8... минут, но не больше часа
+RETRY_BASE = timedelta(minutes=1)
+RETRY_MAX = timedelta(hours=1)
+# Сколько письмо остается за обработчиком; после этого его заберет другой
+SEND_LEASE = timedelta(minutes=10)
+
+
+def enqueue_mail(subject, message, from_email, to):
+    '''Ставит письмо в очередь вместо отправки во время запроса'''
+    return QueuedEmail.objects.create(subject=subject, body=message,
+                                      from_email=from_email, to=to)
+
+
+def retry_delay(attempts):
+    '''Экспоненциальная задержка после attempts неудачных попыток'''
+    return min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+
+
+def mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.status = 'queued'
+        email.next_attempt = now + retry_delay(email.attempts)
+
+
+def defer(email, error, now):
+    '''
+    Сервер недоступен: письмо возвращается в очередь без попытки,
+    иначе долгий сбой сервера пометил бы всю очередь как failed.
+    '''
+    email.last_error = str(error)
+    email.status = 'queued'
+    email.next_attempt = now + RETRY_BASE
+
+
+def connection_lost(error):
+    '''Обрыв соединения или сетевая ошибка (SMTPException - тоже OSError)'''
+    return isinstance(error, smtplib.SMTPServerDisconnected) \
+        or not isinstance(error, smtplib.SMTPException)
+
+
+def claim_batch(batch_size):
+    '''
+    Забирает пачку писем в короткой транзакции: строки блокируются с
+    SKIP LOCKED и помечаются как sending с арендой до next_attempt.
+    Письма, чья аренда истекла (обработчик упал), забираются снова.
+    '''
+    with transaction.atomic():
+        now = timezone.now()
+        batch = list(QueuedEmail.objects.select_for_update(skip_locked=True)
+                     .filter(status__in=('queued', 'sending'), next_attempt__lte=now)
+                     .order_by('next_attempt')[:batch_size])
+        QueuedEmail.objects.filter(id__in=[email.id for email in batch])\
+            .update(status='sending', next_attempt=now + SEND_LEASE)
+    return batch
+
+
+def send_queued_mail(batch_size=50, connection=None):
+    '''
+    Отправляет одну пачку писем, которым пришло время, через одно
+    SMTP соединение. Письма сначала забираются (claim_batch), затем
+    отправляются вне транзакции: медленный SMTP сервер не держит
+    блокировки строк. Результаты записываются второй короткой транзакцией.
+    Можно запускать несколько обработчиков одновременно.
+    Возвращает количество обработанных писем.
+    '''
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0
+    now = timezone.now()
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except (smtplib.SMTPException, OSError) as error:
+        # Сервер недоступен - откладываем всю пачку
+        for email in batch:
+            defer(email, error, now)
+    else:
+        try:
+            for index, email in enumerate(batch):
+                try:
+                    EmailMessage(email.subject, email.body, email.from_email,
+                                 [email.to], connection=connection).send()
+                except (smtplib.SMTPException, OSError) as error:
+                    if not connection_lost(error):
+                        # Ошибка конкретного письма (адрес отклонен и т.п.)
+                        mark_failed(email, error, now)
+                        continue
+                    # Соединение потеряно - откладываем оставшиеся письма
+                    for rest in batch[index:]:
+                        defer(rest, error, now)
+                    break
+                else:
+                    email.attempts += 1
+                    email.status = 'sent'
+                    email.sent = timezone.now()
+        finally:
+            connection.close()
+    # bulk_update - вторая короткая транзакция
+    QueuedEmail.objects.bulk_update(
+        batch, ['status', 'attempts', 'next_attempt', 'last_error', 'sent'])
+    return len(batch)
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.bench import run_asgi, run_wsgi
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    '''
+    Сравнение пропускной способности и задержек WSGI и ASGI.
+    Запросы подаются прямо в WSGI/ASGI приложение Django (без сетевого
+    сервера), с заданным числом одновременных запросов. С --compare
+    команда запускает себя дважды: WSGI с синхронными обработчиками и
+    ASGI с асинхронными (BLOG_ASYNC_VIEWS=1), и печатает обе сводки.
+    '''
+    help = 'Benchmark read endpoints through the WSGI and ASGI handlers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi'),
+                            help='Handler to drive (default: asgi if BLOG_ASYNC_VIEWS)')
+        parser.add_argument('--compare', action='store_true',
+                            help='Run WSGI and ASGI in subprocesses and compare')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per path')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request, may be repeated')
+        parser.add_argument('--with-page-cache', action='store_true',
+                            help='Keep the anonymous page cache enabled')
+        parser.add_argument('--json', action='store_true',
+                            help='Print a machine-readable report')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(options)
+        if not options['with_page_cache']:
+            settings.BLOG_PAGE_CACHE_TIMEOUT = 0
+        server = options['server'] or ('asgi' if settings.BLOG_ASYNC_VIEWS else 'wsgi')
+        paths = options['paths'] or self.default_paths()
+        run = run_asgi if server == 'asgi' else run_wsgi
+        report = {'server': server,
+                  'async_views': settings.BLOG_ASYNC_VIEWS,
+                  'concurrency': options['concurrency'],
+                  'paths': {}}
+        for path in paths:
+            # Прогрев: кэши, соединения, компиляция шаблонов
+            run([path], min(options['concurrency'] * 2, options['requests']),
+                options['concurrency'], options['host'])
+            report['paths'][path] = run([path], options['requests'],
+                                        options['concurrency'], options['host'])
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+        else:
+            self.print_report(report)
+
+    def default_paths(self):
+        paths = ['/blog/', '/blog/search/?query=django', '/blog/feed/']
+        post = Post.published.order_by('-publish').first()
+        if post is not None:
+            paths.insert(1, post.get_absolute_url())
+        return paths
+
+    def compare(self, options):
+        reports = []
+        for server, async_views in (('wsgi', '0'), ('asgi', '1')):
+            command = [sys.executable, sys.argv[0], 'bench_asgi', '--json',
+                       '--server', server,
+                       '--requests', str(options['requests']),
+                       '--concurrency', str(options['concurrency']),
+                       '--host', options['host']]
+            for path in options['paths'] or ():
+                command += ['--path', path]
+            if options['with_page_cache']:
+                command.append('--with-page-cache')
+            env = dict(os.environ, BLOG_ASYNC_VIEWS=async_views)
+            output = subprocess.run(command, env=env, check=True,
+                                    stdout=subprocess.PIPE).stdout.decode()
+            reports.append(json.loads(output.strip().splitlines()[-1]))
+        if options['json']:
+            self.stdout.write(json.dumps(reports))
+        else:
+            for report in reports:
+                self.print_report(report)
+
+    def print_report(self, report):
+        self.stdout.write('{} (async views: {}), concurrency {}'.format(
+            report['server'].upper(), report['async_views'], report['concurrency']))
+        for path, stats in report['paths'].items():
+            self.stdout.write('  {:<45} {:>8} rps  p50 {:>8} ms  p99 {:>8} ms'.format(
+                path, stats['rps'], stats['p50_ms'], stats['p99_ms']))
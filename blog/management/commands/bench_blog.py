@@ -0,0 +1,123 @@
+import json
+import platform
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import TaggedItem
+from blog.bench import run_asgi, run_wsgi
+from blog.models import Post, Comment
+from blog.pagination import encode_cursor
+
+
+class Command(BaseCommand):
+    '''
+    Нагрузочный прогон по основным страницам блога на текущей БД.
+    Для каждой группы адресов считает пропускную способность, перцентили
+    задержки и количество SQL запросов (из Server-Timing) и пишет
+    JSON отчет, который можно сравнивать между версиями.
+    Данные для прогона создает команда seed_blog.
+    '''
+    help = 'Benchmark blog endpoints and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--sample', type=int, default=50,
+                            help='Distinct detail pages to request')
+        parser.add_argument('--with-page-cache', action='store_true',
+                            help='Keep the anonymous page cache enabled')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only run this endpoint, may be repeated')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if not options['with_page_cache']:
+            settings.BLOG_PAGE_CACHE_TIMEOUT = 0
+        # Количество запросов берется из Server-Timing
+        settings.BLOG_INSTRUMENTATION = True
+        run = run_asgi if options['server'] == 'asgi' else run_wsgi
+        endpoints = self.endpoints(options['sample'])
+        if options['endpoints']:
+            endpoints = {name: paths for name, paths in endpoints.items()
+                         if name in options['endpoints']}
+        report = {'meta': self.meta(options), 'endpoints': {}}
+        for name, paths in endpoints.items():
+            if not paths:
+                continue
+            run(paths, min(len(paths), options['requests']),
+                options['concurrency'], options['host'])
+            stats = run(paths, options['requests'], options['concurrency'], options['host'])
+            stats['paths'] = len(paths)
+            report['endpoints'][name] = stats
+            self.stdout.write('{:<18} {:>8} rps  p50 {:>9} ms  p95 {:>9} ms  '
+                              'p99 {:>9} ms  queries {}'.format(
+                                  name, stats['rps'], stats['p50_ms'], stats['p95_ms'],
+                                  stats['p99_ms'], stats.get('queries_mean')))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS('Report written to {}'.format(options['output'])))
+
+    def endpoints(self, sample):
+        '''Адреса для каждой группы, выбираются из текущих данных'''
+        published = Post.published.order_by('-publish', '-id')
+        total = published.count()
+        list_urls = [reverse('blog:post_list')]
+        deep_urls = []
+        offset_urls = []
+        if total > 10:
+            # Страница в глубине архива, 90% от начала
+            position = published[total * 9 // 10]
+            deep_urls.append('{}?cursor={}'.format(list_urls[0],
+                                                   encode_cursor(position, 'next')))
+            offset_urls.append('{}?page={}'.format(list_urls[0], max(1, total * 9 // 10 // 3)))
+        top_tags = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post)
+        ).values('tag__slug').annotate(n=Count('id')).order_by('-n')[:5]
+        detail = [post.get_absolute_url()
+                  for post in published.only('slug', 'publish').order_by('?')[:sample]]
+        words = {word.lower() for title in published.values_list('title', flat=True)[:20]
+                 for word in title.split()}
+        months = published.values_list('publish', flat=True)[:1]
+        sitemap = [reverse('sitemap_index')] + [
+            reverse('sitemap_section', args=[month.year, month.month]) for month in months]
+        return {
+            'post_list': list_urls,
+            'post_list_deep': deep_urls,
+            'post_list_offset': offset_urls,
+            'tag': [reverse('blog:post_list_by_tag', args=[tag['tag__slug']])
+                    for tag in top_tags],
+            'post_detail': detail,
+            'post_search': ['{}?query={}'.format(reverse('blog:post_search'), word)
+                            for word in sorted(words)[:10]],
+            'feed': [reverse('blog:post_feed')],
+            'sitemap': sitemap,
+        }
+
+    def meta(self, options):
+        return {
+            'created': timezone.now().isoformat(),
+            'server': options['server'],
+            'async_views': settings.BLOG_ASYNC_VIEWS,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'page_cache': options['with_page_cache'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'dataset': {
+                'posts': Post.objects.count(),
+                'published': Post.published.count(),
+                'comments': Comment.objects.count(),
+                'tags': TaggedItem.tags_for(Post).count(),
+            },
+        }
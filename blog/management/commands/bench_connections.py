@@ -0,0 +1,60 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.postgresql.base import DatabaseWrapper as PlainWrapper
+from blog.bench import summarize
+from yoga.db.pooled.base import DatabaseWrapper as PooledWrapper
+from yoga.db.pooled.pool import close_pools
+
+
+class Command(BaseCommand):
+    '''
+    Сравнение стоимости соединения с БД на запрос: новое соединение
+    (CONN_MAX_AGE = 0, как сейчас) против соединения из пула.
+    Каждый "запрос" - подключение, один SELECT и закрытие, как в
+    обработчике запроса Django.
+    '''
+    help = 'Compare per-request PostgreSQL connections with the pooled backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        plain = copy.deepcopy(settings_dict)
+        plain['OPTIONS'].pop('pool', None)
+        pooled = copy.deepcopy(plain)
+        pooled['OPTIONS']['pool'] = {'max_size': options['concurrency']}
+        for name, wrapper_class, settings_copy in (('connect', PlainWrapper, plain),
+                                                   ('pool', PooledWrapper, pooled)):
+            stats = self.run(wrapper_class, settings_copy, options['database'],
+                             options['requests'], options['concurrency'])
+            self.stdout.write('{:<8} {:>8} rps  mean {:>7} ms  p50 {:>7} ms  p99 {:>7} ms'.format(
+                name, stats['rps'], stats['mean_ms'], stats['p50_ms'], stats['p99_ms']))
+        close_pools()
+
+    def run(self, wrapper_class, settings_dict, alias, count, concurrency):
+        # Соединение Django нельзя делить между потоками: обертка на поток
+        local = threading.local()
+
+        def request(_):
+            if not hasattr(local, 'wrapper'):
+                local.wrapper = wrapper_class(settings_dict, alias)
+            start = time.perf_counter()
+            with local.wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            local.wrapper.close()
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(request, range(concurrency * 2)))
+            start = time.perf_counter()
+            latencies = list(executor.map(request, range(count)))
+            elapsed = time.perf_counter() - start
+        return summarize(latencies, elapsed)
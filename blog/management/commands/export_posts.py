@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from blog.models import Post
+from blog.transfer import FORMATS, export_records, format_for, write_records
+
+
+class Command(BaseCommand):
+    '''
+    Выгружает статьи с тегами и комментариями в JSON Lines или CSV.
+    Статьи читаются пачками по id, вся таблица в память не загружается.
+    '''
+    help = 'Export posts with tags and comments to JSON Lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, "-" for stdout')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format (default: by file extension)')
+        parser.add_argument('--status', choices=[choice for choice, _ in Post.STATUS_CHOICES],
+                            help='Export only posts with this status')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts read per query')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or format_for(path)
+        queryset = Post.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+        records = export_records(queryset, options['batch_size'])
+        if path == '-':
+            write_records(records, self.stdout, format)
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            count = write_records(records, stream, format)
+        self.stdout.write(self.style.SUCCESS('Exported {} posts to {}'.format(count, path)))
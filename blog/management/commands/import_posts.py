@@ -0,0 +1,71 @@
+import sys
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import TaggedItem
+from blog.models import Post
+from blog.signals import invalidate_bulk_changes
+from blog.similar import posts_sharing_tags, queue_similar_posts
+from blog.transfer import FORMATS, chunked, format_for, import_chunk, read_records
+
+
+class Command(BaseCommand):
+    '''
+    Загружает статьи с тегами и комментариями из JSON Lines или CSV
+    (формат export_posts). Каждая пачка - одна транзакция с bulk_create
+    статей, тегов и комментариев. Уже загруженные статьи (тот же slug
+    в тот же день) пропускаются. Загруженные статьи и статьи с общими
+    тегами ставятся в очередь пересчета похожих статей, его выполняет
+    rebuild_similar_posts --stale.
+    '''
+    help = 'Import posts with tags and comments from JSON Lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, "-" for stdin')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: by file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts inserted per transaction')
+        parser.add_argument('--skip-similar', action='store_true',
+                            help='Do not queue similar posts of the imported posts')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or format_for(path)
+        if path == '-':
+            stream = sys.stdin
+        else:
+            stream = open(path, encoding='utf-8', newline='')
+        content_type = ContentType.objects.get_for_model(Post)
+        users = {}
+        imported = 0
+        skipped = 0
+        try:
+            for records in chunked(read_records(stream, format), options['batch_size']):
+                with transaction.atomic():
+                    ids, chunk_skipped, invalid = import_chunk(records, users, content_type)
+                    if ids and not options['skip_similar']:
+                        queue_similar_posts(ids)
+                        queue_similar_posts(list(posts_sharing_tags(ids)))
+                if ids:
+                    # bulk_create не вызывает сигналы
+                    invalidate_bulk_changes(TaggedItem.objects.filter(
+                        content_type=content_type, object_id__in=ids
+                    ).values_list('tag__slug', flat=True))
+                for slug, status in invalid:
+                    self.stderr.write('Skipped post "{}": unknown status "{}"'.format(slug, status))
+                imported += len(ids)
+                skipped += chunk_skipped
+                self.stdout.write('Imported {} posts, skipped {}'.format(imported, skipped))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        if imported:
+            call_command('rebuild_tag_stats', stdout=self.stdout)
+            call_command('rebuild_archive', stdout=self.stdout)
+            # Счетчики архива и тегов в боковой панели
+            invalidate_bulk_changes()
+        self.stdout.write(self.style.SUCCESS(
+            'Done: {} posts imported, {} skipped'.format(imported, skipped)))
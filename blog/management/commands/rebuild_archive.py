@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from blog.archive import recount_archive
+
+
+class Command(BaseCommand):
+    '''
+    Пересчитывает количество опубликованных статей по месяцам.
+    Нужна после загрузки данных в обход сигналов (bulk_create) и после
+    смены TIME_ZONE, в обычной работе счетчики меняют сигналы.
+    '''
+    help = 'Recount published posts per month for the date archive'
+
+    def handle(self, *args, **options):
+        total = recount_archive()
+        self.stdout.write(self.style.SUCCESS('Done: {} months'.format(total)))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from blog.models import Post, StaleSimilarPost
+from blog.similar import refresh_similar_posts
+
+
+class Command(BaseCommand):
+    '''
+    Полностью пересчитывает таблицу похожих статей.
+    Нужна после первого развертывания и для исправления расхождений,
+    в обычной работе таблицу поддерживают сигналы.
+    С --stale пересчитывает только списки из очереди StaleSimilarPost,
+    которые сигналы не успели обновить в запросе (запуск по cron).
+    '''
+    help = 'Rebuild the precomputed similar posts of every published post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of posts refreshed per transaction')
+        parser.add_argument('--stale', action='store_true',
+                            help='Only refresh posts queued as stale by the signals')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            if options['stale']:
+                # Пересчитанные статьи удаляются из очереди
+                batch = list(StaleSimilarPost.objects.order_by('post_id')
+                             .values_list('post_id', flat=True)[:batch_size])
+            else:
+                batch = list(Post.published.filter(id__gt=last_id).order_by('id')
+                             .values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            refresh_similar_posts(batch)
+            last_id = batch[-1]
+            total += len(batch)
+            self.stdout.write('Refreshed {} posts'.format(total))
+        self.stdout.write(self.style.SUCCESS('Done: {} posts'.format(total)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from blog.tagstats import recount_tag_stats
+
+
+class Command(BaseCommand):
+    '''
+    Пересчитывает количество опубликованных статей у всех тегов.
+    Нужна после загрузки данных в обход сигналов (bulk_create) и для
+    исправления расхождений, в обычной работе счетчики меняют сигналы.
+    '''
+    help = 'Recount published posts per tag from the taggit through table'
+
+    def handle(self, *args, **options):
+        total = recount_tag_stats()
+        self.stdout.write(self.style.SUCCESS('Done: {} tags'.format(total)))
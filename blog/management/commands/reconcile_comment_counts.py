@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from blog.counters import drifted_posts, recount_comments
+
+
+class Command(BaseCommand):
+    '''
+    Сверяет Post.comments_count с реальным количеством активных
+    комментариев и исправляет расхождения (например, после массовых
+    UPDATE в обход сигналов).
+    '''
+    help = 'Find and repair drift in Post.comments_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drifted posts')
+
+    def handle(self, *args, **options):
+        drifted = list(drifted_posts().values_list('id', 'comments_count', 'actual'))
+        for post_id, stored, actual in drifted:
+            self.stdout.write('Post {}: stored {}, actual {}'.format(post_id, stored, actual))
+        if drifted and not options['dry_run']:
+            recount_comments([post_id for post_id, _, _ in drifted])
+        self.stdout.write(self.style.SUCCESS('Drifted posts: {}'.format(len(drifted))))
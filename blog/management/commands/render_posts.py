@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    '''
+    Заполняет body_html и excerpt у уже существующих статей.
+    Статьи обрабатываются пачками по первичному ключу, чтобы не держать
+    в памяти всю таблицу и не открывать одну большую транзакцию.
+    '''
+    help = 'Render Markdown body to stored HTML and excerpt for all posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts rendered per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(Post.objects.filter(id__gt=last_id)
+                         .order_by('id').only('id', 'body')[:batch_size])
+            if not batch:
+                break
+            for post in batch:
+                post.render_body()
+            with transaction.atomic():
+                Post.objects.bulk_update(batch, ['body_html', 'excerpt'])
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write('Rendered {} posts'.format(total))
+        self.stdout.write(self.style.SUCCESS('Done: {} posts'.format(total)))
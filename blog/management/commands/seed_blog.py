@@ -0,0 +1,172 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+from blog.cache import bump_version
+from blog.models import Post, Comment, SimilarPost, post_search_vector
+from blog.pagecache import detail_group
+from blog.signals import invalidate_bulk_changes
+
+# Все синтетические данные помечены этим префиксом, --clear удаляет только их
+PREFIX = 'bench-'
+
+WORDS = ('django python postgres index query cache template view model '
+         'migration signal request response server client worker queue '
+         'search vector page cursor feed sitemap comment tag author blog '
+         'async thread pool replica router counter archive markdown html '
+         'static deploy release benchmark latency throughput memory disk '
+         'network socket session cookie token form field admin').split()
+
+
+class Command(BaseCommand):
+    '''
+    Заполняет БД синтетическими статьями, тегами, комментариями и
+    пользователями для нагрузочных тестов (см. bench_blog). Данные
+    вставляются пачками через bulk_create, генератор случайных чисел
+    инициализируется --seed, поэтому набор данных воспроизводим.
+    '''
+    help = 'Seed a reproducible synthetic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--tags-per-post', type=int, default=3)
+        parser.add_argument('--comments', type=int, default=5,
+                            help='Average number of comments per post')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--words', type=int, default=300,
+                            help='Words in a post body')
+        parser.add_argument('--days', type=int, default=3 * 365,
+                            help='Spread publish dates over this many days')
+        parser.add_argument('--drafts', type=float, default=0.1,
+                            help='Share of posts left as drafts')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete previously seeded data first')
+        parser.add_argument('--skip-similar', action='store_true',
+                            help='Do not rebuild the similar posts table')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        if options['clear']:
+            self.clear()
+        authors = self.seed_users(options['users'])
+        tags = self.seed_tags(options['tags'])
+        # Популярность тегов по закону Ципфа: первые теги встречаются чаще
+        weights = [1 / rank for rank in range(1, len(tags) + 1)]
+        content_type = ContentType.objects.get_for_model(Post)
+        start = Post.objects.filter(slug__startswith=PREFIX).count()
+        now = timezone.now()
+        created = 0
+        while created < options['posts']:
+            size = min(options['batch_size'], options['posts'] - created)
+            numbers = range(start + created, start + created + size)
+            with transaction.atomic():
+                self.seed_batch(numbers, authors, tags, weights, content_type,
+                                now, options)
+            created += size
+            self.stdout.write('Seeded {} posts'.format(created))
+        Post.objects.filter(slug__startswith=PREFIX)\
+            .update(search_vector=post_search_vector())
+        if not options['skip_similar']:
+            call_command('rebuild_similar_posts', stdout=self.stdout)
+        call_command('rebuild_tag_stats', stdout=self.stdout)
+        call_command('rebuild_archive', stdout=self.stdout)
+        # bulk_create не вызывает сигналы
+        invalidate_bulk_changes(Tag.objects.filter(slug__startswith=PREFIX)
+                                .values_list('slug', flat=True))
+        self.stdout.write(self.style.SUCCESS('Done: {} posts'.format(created)))
+
+    def seed_users(self, count):
+        password = make_password(None)
+        User.objects.bulk_create(
+            [User(username='{}user-{}'.format(PREFIX, i), password=password)
+             for i in range(count)], ignore_conflicts=True)
+        return list(User.objects.filter(username__startswith=PREFIX)
+                    .values_list('id', flat=True))
+
+    def seed_tags(self, count):
+        Tag.objects.bulk_create(
+            [Tag(name='{}{}-{}'.format(PREFIX, WORDS[i % len(WORDS)], i),
+                 slug='{}{}-{}'.format(PREFIX, WORDS[i % len(WORDS)], i))
+             for i in range(count)], ignore_conflicts=True)
+        return list(Tag.objects.filter(slug__startswith=PREFIX)
+                    .order_by('id').values_list('id', flat=True))
+
+    def text(self, words):
+        paragraphs = []
+        while words > 0:
+            size = min(words, self.rng.randint(30, 80))
+            paragraphs.append(' '.join(self.rng.choice(WORDS) for _ in range(size)))
+            words -= size
+        return '\n\n'.join(paragraphs)
+
+    def seed_batch(self, numbers, authors, tags, weights, content_type, now, options):
+        rng = self.rng
+        posts = []
+        comments_per_post = []
+        for number in numbers:
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 7))).capitalize()
+            post = Post(title=title,
+                        slug='{}post-{}'.format(PREFIX, number),
+                        author_id=rng.choice(authors),
+                        body=self.text(options['words']),
+                        publish=now - timedelta(seconds=rng.randint(0, options['days'] * 86400)),
+                        status='draft' if rng.random() < options['drafts'] else 'published')
+            post.render_body()
+            comments = [rng.random() > 0.1
+                        for _ in range(rng.randint(0, 2 * options['comments']))]
+            post.comments_count = sum(comments)
+            posts.append(post)
+            comments_per_post.append(comments)
+        Post.objects.bulk_create(posts)
+        tagged = []
+        comments = []
+        for post, active_flags in zip(posts, comments_per_post):
+            count = min(options['tags_per_post'], len(tags))
+            chosen = set()
+            while len(chosen) < count:
+                chosen.add(rng.choices(tags, weights)[0])
+            tagged.extend(TaggedItem(content_type=content_type, object_id=post.id,
+                                     tag_id=tag_id) for tag_id in chosen)
+            comments.extend(Comment(post_id=post.id,
+                                    name='{}reader-{}'.format(PREFIX, rng.randint(0, 999)),
+                                    email='reader@example.com',
+                                    body=self.text(rng.randint(5, 40)),
+                                    active=active)
+                            for active in active_flags)
+        TaggedItem.objects.bulk_create(tagged)
+        Comment.objects.bulk_create(comments)
+
+    def clear(self):
+        '''Удаление одним SQL на таблицу, без загрузки объектов и сигналов'''
+        posts = 'SELECT id FROM {} WHERE slug LIKE %s'.format(Post._meta.db_table)
+        pattern = PREFIX + '%'
+        content_type = ContentType.objects.get_for_model(Post)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Закэшированные страницы удаляемых статей и тегов, версии
+            # увеличатся еще раз после фиксации транзакции
+            for publish, slug in Post.objects.filter(slug__startswith=PREFIX)\
+                    .values_list('publish', 'slug').iterator():
+                bump_version(detail_group(publish, slug))
+            invalidate_bulk_changes(Tag.objects.filter(slug__startswith=PREFIX)
+                                    .values_list('slug', flat=True))
+            cursor.execute('DELETE FROM {} WHERE post_id IN ({}) OR similar_id IN ({})'.format(
+                SimilarPost._meta.db_table, posts, posts), [pattern, pattern])
+            cursor.execute('DELETE FROM {} WHERE post_id IN ({})'.format(
+                Comment._meta.db_table, posts), [pattern])
+            cursor.execute('DELETE FROM {} WHERE content_type_id = %s AND object_id IN ({})'.format(
+                TaggedItem._meta.db_table, posts), [content_type.id, pattern])
+            cursor.execute('DELETE FROM {} WHERE slug LIKE %s'.format(
+                Post._meta.db_table), [pattern])
+        Tag.objects.filter(slug__startswith=PREFIX).delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
+        self.stdout.write('Cleared previously seeded data')
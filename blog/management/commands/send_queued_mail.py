@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from blog.mail import send_queued_mail
+
+
+class Command(BaseCommand):
+    '''
+    Фоновая отправка писем из очереди QueuedEmail.
+    Без --loop отправляет все готовые письма и завершается (для cron),
+    с --loop работает постоянно и опрашивает очередь раз в --interval секунд.
+    '''
+    help = 'Deliver queued emails in batches over a reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Emails sent over one SMTP connection')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the queue')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = send_queued_mail(options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Processed {} emails'.format(total)))
@@ -0,0 +1,15 @@
+from django.utils.text import Truncator
+import markdown
+
+# Количество слов в анонсе статьи на странице списка
+EXCERPT_WORDS = 30
+
+
+def render_markdown(text):
+    '''Преобразует текст статьи из Markdown в HTML'''
+    return markdown.markdown(text)
+
+
+def make_excerpt(html, words=EXCERPT_WORDS):
+    '''Обрезает готовый HTML до words слов, сохраняя корректность тегов'''
+    return Truncator(html).words(words, html=True, truncate=' …')
@@ -0,0 +1,125 @@
+import time
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.deprecation import MiddlewareMixin
+from .instrumentation import finish_request, logger, start_request
+from .pagecache import CACHED_ROUTES, get_page, page_cache_key, set_page
+from .routers import allow_replica_reads, is_pinned, pin_to_primary, replicas
+
+
+class AnonymousPageCacheMiddleware(MiddlewareMixin):
+    '''
+    Кэш готовых страниц для анонимных читателей.
+    Кэшируются только GET/HEAD запросы к маршрутам из CACHED_ROUTES.
+    Не кэшируются ответы авторизованным пользователям, ответы с
+    cookie и страницы с CSRF токеном (формы). Должен стоять в MIDDLEWARE
+    после AuthenticationMiddleware.
+    '''
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._page_cache_key = None
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        match = request.resolver_match
+        if match is None or match.view_name not in CACHED_ROUTES:
+            return None
+        if not self.is_anonymous(request):
+            return None
+        request._page_cache_key = page_cache_key(request, match)
+        response = get_page(request._page_cache_key)
+        if response is not None:
+            request._page_cache_key = None
+            response['X-Page-Cache'] = 'hit'
+        return response
+
+    def process_response(self, request, response):
+        key = getattr(request, '_page_cache_key', None)
+        if key is None or response.status_code != 200 or response.streaming:
+            return response
+        if request.META.get('CSRF_COOKIE_USED') or response.cookies:
+            return response
+        if 'private' in response.get('Cache-Control', ''):
+            return response
+        set_page(key, response)
+        return response
+
+    @staticmethod
+    def is_anonymous(request):
+        '''Без cookie сессии пользователь анонимен, сессию не трогаем'''
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return True
+        return not request.user.is_authenticated
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    '''
+    Количество SQL запросов, время SQL и рендеринга шаблонов для
+    каждого запроса. Данные уходят в заголовок Server-Timing и в логгер
+    blog.perf; самые медленные запросы логируются, если запрос дольше
+    BLOG_SLOW_REQUEST_MS. Включается настройкой BLOG_INSTRUMENTATION.
+    '''
+
+    def process_request(self, request):
+        if getattr(settings, 'BLOG_INSTRUMENTATION', False):
+            request._perf_stats = start_request()
+            request._perf_start = time.perf_counter()
+
+    def process_response(self, request, response):
+        stats = getattr(request, '_perf_stats', None)
+        if stats is None:
+            return response
+        finish_request()
+        total = (time.perf_counter() - request._perf_start) * 1000
+        sql = stats.sql_time * 1000
+        template = stats.template_time * 1000
+        match = request.resolver_match
+        view_name = match.view_name if match else '-'
+        response['Server-Timing'] = (
+            'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, total;dur={:.1f}'
+            .format(sql, stats.queries, template, total))
+        logger.info('view=%s status=%s queries=%d sql_ms=%.1f tpl_ms=%.1f total_ms=%.1f',
+                    view_name, response.status_code, stats.queries, sql, template, total)
+        if total >= getattr(settings, 'BLOG_SLOW_REQUEST_MS', 500):
+            for duration, statement in sorted(stats.slowest, reverse=True):
+                logger.warning('slow view=%s sql_ms=%.1f %s',
+                               view_name, duration * 1000, statement)
+        return response
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    '''
+    Разрешает PrimaryReplicaRouter читать с реплик в GET/HEAD запросах.
+    После успешного запроса на запись (комментарий, отправка письма,
+    админка) сессия на BLOG_REPLICA_PIN_SECONDS читает с основной БД,
+    чтобы пользователь видел свои изменения несмотря на отставание реплик.
+    Должен стоять в MIDDLEWARE после SessionMiddleware.
+    '''
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_request(self, request):
+        if replicas():
+            allow_replica_reads(request.method in self.safe_methods
+                                and not is_pinned(request))
+
+    def process_response(self, request, response):
+        if not replicas():
+            return response
+        allow_replica_reads(False)
+        if request.method not in self.safe_methods and response.status_code < 400:
+            pin_to_primary(request)
+        return response
+
+
+class CsrfSafeGZipMiddleware(GZipMiddleware):
+    '''
+    GZipMiddleware, который не сжимает ответы с CSRF токеном в теле
+    (формы комментария, отправки письма, админка). Сжатие секрета рядом
+    с данными из запроса открывает атаку BREACH, поэтому такие страницы
+    отдаются без сжатия. Списки, RSS, карта сайта и API сжимаются.
+    '''
+
+    def process_response(self, request, response):
+        if request.META.get('CSRF_COOKIE_USED'):
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,33 @@
+# Generated by Django 3.1 on 2026-10-18 18:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_comments_count(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    active = Comment.objects.filter(post=OuterRef('pk'), active=True).order_by()\
+        .values('post').annotate(n=Count('id')).values('n')
+    Post.objects.update(comments_count=Coalesce(Subquery(active), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_similarpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(status='published'), fields=['-comments_count', '-publish'], name='blog_post_most_commented_idx'),
+        ),
+        migrations.RunPython(fill_comments_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_queuedemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(active=True), fields=['post', 'created'], name='blog_comment_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(status='published'), fields=['-publish', '-id'], name='blog_post_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    '''
+    Расширение pg_trgm и триграммные GIN индексы для подсказок поиска:
+    по заголовкам статей и по именам тегов (таблица taggit, поэтому SQL).
+    '''
+
+    dependencies = [
+        ('blog', '0010_query_indexes'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='blog_post_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX blog_tag_name_trgm_idx ON taggit_tag USING gin (name gin_trgm_ops)',
+            'DROP INDEX blog_tag_name_trgm_idx',
+        ),
+    ]
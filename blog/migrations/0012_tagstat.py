@@ -0,0 +1,44 @@
+# Generated by Django 3.1 on 2026-10-18 18:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def fill_tag_stats(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TagStat = apps.get_model('blog', 'TagStat')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    published = Post.objects.filter(status='published').values('id')
+    counts = TaggedItem.objects.filter(content_type=content_type, object_id__in=published)\
+        .order_by().values('tag_id').annotate(n=Count('id')).values_list('tag_id', 'n')
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, published_count=n)
+                                 for tag_id, n in counts])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('blog', '0011_trigram_indexes'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStat',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='blog_stat', serialize=False, to='taggit.tag')),
+                ('published_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagstat',
+            index=models.Index(fields=['-published_count'], name='blog_tagstat_count_idx'),
+        ),
+        migrations.RunPython(fill_tag_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1 on 2026-10-18 18:24
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def fill_archive(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    ArchiveMonth = apps.get_model('blog', 'ArchiveMonth')
+    months = Post.objects.filter(status='published').annotate(month=TruncMonth('publish'))\
+        .order_by().values('month').annotate(n=Count('id')).values_list('month', 'n')
+    ArchiveMonth.objects.bulk_create([ArchiveMonth(year=month.year, month=month.month,
+                                                   published_count=n)
+                                      for month, n in months])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_tagstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('published_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-year', '-month'),
+                'unique_together': {('year', 'month')},
+            },
+        ),
+        migrations.RunPython(fill_archive, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1 on 2026-10-18 18:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_archivemonth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleSimilarPost',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar_stale', serialize=False, to='blog.post')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_stalesimilarpost'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='queuedemail',
+            name='blog_email_queue_idx',
+        ),
+        migrations.AlterField(
+            model_name='queuedemail',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='queuedemail',
+            index=models.Index(condition=models.Q(status__in=('queued', 'sending')), fields=['next_attempt'], name='blog_email_queue_idx'),
+        ),
+    ]
@@ -1,8 +1,15 @@
+import datetime
+
 from django.db import models
+from django.db.models import Q, Value
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from taggit.managers import TaggableManager
+from taggit.models import Tag
+from .markup import render_markdown, make_excerpt
 
 
 class PublishedManager(models.Manager):
@@ -11,6 +18,35 @@ class PublishedManager(models.Manager):
         '''Возвращает QuerySet для выполнения'''
         return super(PublishedManager, self).get_queryset().filter(status='published')
 
+    def by_date(self, year, month, day, slug):
+        '''
+        Статьи с данным slug, опубликованные в указанный день.
+        День задается диапазоном publish (в текущей зоне), а не
+        publish__year/__month/__day: по диапазону работает индекс
+        (slug, publish). Несуществующая дата - пустой QuerySet.
+        '''
+        try:
+            day = datetime.date(int(year), int(month), int(day))
+        except ValueError:
+            return self.none()
+        start = datetime.datetime.combine(day, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        return self.get_queryset().filter(slug=slug,
+                                          publish__gte=timezone.make_aware(start),
+                                          publish__lt=timezone.make_aware(end))
+
+
+def post_search_vector(title=None, body=None):
+    '''
+    Взвешенный вектор поиска: заголовок важнее текста статьи.
+    Без аргументов строится по колонкам (массовый UPDATE), с аргументами -
+    по значениям сохраняемой статьи, чтобы попасть в тот же INSERT/UPDATE.
+    '''
+    if title is None:
+        return SearchVector('title', weight='A') + SearchVector('body', weight='B')
+    return SearchVector(Value(title, output_field=models.TextField()), weight='A') + \
+        SearchVector(Value(body, output_field=models.TextField()), weight='B')
+
 
 class Post(models.Model):
     '''поля для таблицы статей'''
@@ -30,12 +66,21 @@ class Post(models.Model):
     created - поле даты создания, дата сохраняется оавтоматически
     updated - дата и время редактирования статьи
     status - поле статуса статьи, мб только STATUS_CHOICES
+    body_html - текст статьи, заранее преобразованный из Markdown в HTML
+    excerpt - анонс статьи для списка, первые слова body_html
+    search_vector - сохраненный tsvector для полнотекстового поиска
+    comments_count - количество активных комментариев, меняется только
+    атомарными UPDATE из сигналов комментариев
     '''
     title = models.CharField(max_length=250)
     slug = models.SlugField(max_length=250,unique_for_date='publish')
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='blog_post')
     body = models.TextField()
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt = models.TextField(blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -49,11 +94,99 @@ class Post(models.Model):
     class Meta:
         ''' Содержит метаданные + сортировка статей по убыванию даты публикации'''
         ordering = ('-publish',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='blog_post_search_idx'),
+            models.Index(fields=['updated'], name='blog_post_updated_idx'),
+            models.Index(fields=['-comments_count', '-publish'],
+                         condition=Q(status='published'),
+                         name='blog_post_most_commented_idx'),
+            # Списки опубликованных статей и курсорная пагинация (publish, id)
+            models.Index(fields=['-publish', '-id'], condition=Q(status='published'),
+                         name='blog_post_published_idx'),
+            # Страница статьи: slug и диапазон дня публикации
+            models.Index(fields=['slug', 'publish'], name='blog_post_slug_publish_idx'),
+            # Подсказки поиска по заголовкам (pg_trgm, миграция 0011)
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'],
+                     name='blog_post_title_trgm_idx'),
+        ]
+
+    # Счетчики, которые обычное сохранение статьи не перезаписывает
+    COUNTER_FIELDS = ('comments_count',)
 
     def __str__(self):
         '''отображение объекта, понятного человеку'''
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''Запоминаем значения из БД, чтобы при сохранении видеть изменения'''
+        instance = super(Post, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def field_changed(self, name):
+        '''Изменилось ли поле с момента загрузки (для новых статей - всегда)'''
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or name not in loaded:
+            return True
+        return loaded[name] != getattr(self, name)
+
+    def render_body(self):
+        '''Заполняет body_html и excerpt из текущего body'''
+        self.body_html = render_markdown(self.body)
+        self.excerpt = make_excerpt(self.body_html)
+
+    def save(self, *args, **kwargs):
+        '''
+        Перед сохранением пересобираем HTML, чтобы не делать это в запросе.
+        search_vector пишется той же командой INSERT/UPDATE.
+        '''
+        deferred = self.get_deferred_fields()
+        if 'body' not in deferred:
+            self.render_body()
+        update_fields = kwargs.get('update_fields')
+        partial = update_fields is None and not self._state.adding \
+            and not kwargs.get('force_insert')
+        if partial:
+            # Не затираем счетчики значениями, прочитанными до их изменения,
+            # и не дочитываем отложенные (.only/.defer) поля
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.name not in self.COUNTER_FIELDS]
+        elif update_fields is not None and 'body' in update_fields:
+            update_fields = set(update_fields) | {'body_html', 'excerpt'}
+        if update_fields is not None:
+            update_fields = set(update_fields) - {'search_vector'}
+        if not {'title', 'body'} & deferred and \
+                (update_fields is None or {'title', 'body'} & update_fields):
+            self.search_vector = post_search_vector(self.title, self.body)
+            if update_fields is not None:
+                update_fields.add('search_vector')
+        if partial and not deferred - {'search_vector'}:
+            # Поля ограничиваются только в UPDATE (_do_update): если строку
+            # успели удалить, Django вставит ее заново, как при обычном save().
+            # С отложенными полями Django и сам сохраняет только UPDATE.
+            self._update_only = update_fields
+        elif update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        try:
+            super(Post, self).save(*args, **kwargs)
+        finally:
+            self._update_only = None
+        if 'search_vector' in self.__dict__ and hasattr(self.search_vector, 'resolve_expression'):
+            # Значение посчитала БД: поле станет отложенным и прочитается по требованию
+            del self.__dict__['search_vector']
+        self._loaded_values = {field.attname: self.__dict__[field.attname]
+                               for field in self._meta.concrete_fields
+                               if field.attname in self.__dict__}
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        only = getattr(self, '_update_only', None)
+        if only is not None:
+            values = [value for value in values if value[0].name in only]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
     def get_absolute_url(self):
         '''Получение сслылок на статьи, указав имя шаблона и параметры'''
         return reverse('blog:post_detail', args=[self.publish.year,
@@ -61,6 +194,43 @@ class Post(models.Model):
                                                  self.publish.day,
                                                  self.slug])
 
+class SimilarPost(models.Model):
+    '''
+    Заранее посчитанные похожие статьи.
+    post - статья, для которой строится список
+    similar - похожая статья
+    rank - место в списке, начиная с 1
+    same_tags - количество общих тегов
+    Список обновляется сигналами при изменении тегов и статуса статей,
+    страница статьи читает его одним запросом по индексу (post, rank).
+    '''
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='similar_links')
+    similar = models.ForeignKey(Post, on_delete=models.CASCADE,
+                                related_name='similar_to')
+    rank = models.PositiveSmallIntegerField()
+    same_tags = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('post', 'rank')
+        unique_together = ('post', 'rank')
+
+    def __str__(self):
+        return '{} -> {}'.format(self.post_id, self.similar_id)
+
+class StaleSimilarPost(models.Model):
+    '''
+    Статья, чей список похожих статей устарел. Сигналы пересчитывают
+    в запросе только ограниченное число списков, остальные попадают сюда
+    и пересчитываются командой rebuild_similar_posts --stale.
+    '''
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True,
+                                related_name='similar_stale')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.post_id)
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     name = models.CharField(max_length=80)
@@ -72,9 +242,104 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('created',)
+        indexes = [
+            # Активные комментарии статьи в порядке создания и их подсчет
+            models.Index(fields=['post', 'created'], condition=Q(active=True),
+                         name='blog_comment_active_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''Запоминаем статью и активность, чтобы правильно менять счетчик'''
+        instance = super(Comment, cls).from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_counted = (loaded.get('post_id'), loaded.get('active'))
+        return instance
 
     def __str__(self):
         return 'Comment by {} on {}'.format(self.name, self.post)
 
 
+class QueuedEmail(models.Model):
+    '''
+    Очередь исходящих писем. Письма отправляет команда send_queued_mail.
+    attempts - сколько раз пытались отправить
+    next_attempt - не раньше какого времени пробовать снова
+    (для sending - до какого времени письмо занято обработчиком)
+    last_error - текст последней ошибки SMTP
+    '''
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    subject = models.CharField(max_length=500)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [
+            models.Index(fields=['next_attempt'],
+                         condition=Q(status__in=('queued', 'sending')),
+                         name='blog_email_queue_idx'),
+        ]
+
+    def __str__(self):
+        return 'Email to {}: {}'.format(self.to, self.subject)
+
+
+class TagStat(models.Model):
+    '''
+    Количество опубликованных статей с тегом. Поддерживается сигналами
+    (см. tagstats.py), чтобы облако тегов и страницы тегов не считали
+    статьи по таблице связей taggit.
+    '''
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True,
+                               related_name='blog_stat')
+    published_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-published_count'], name='blog_tagstat_count_idx'),
+        ]
+
+    def __str__(self):
+        return '{}: {}'.format(self.tag_id, self.published_count)
+
+
+class ArchiveMonth(models.Model):
+    '''
+    Количество опубликованных статей за месяц (в текущей зоне).
+    Поддерживается сигналами (см. archive.py), чтобы архив и виджет
+    боковой панели не группировали всю таблицу статей по месяцам.
+    '''
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    published_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-year', '-month')
+        unique_together = ('year', 'month')
+
+    def __str__(self):
+        return '{}-{:02d}: {}'.format(self.year, self.month, self.published_count)
+
+    @property
+    def date(self):
+        return datetime.date(self.year, self.month, 1)
+
+    def get_absolute_url(self):
+        return reverse('blog:post_archive_month', args=[self.year, self.month])
+
+
 # Create your models here.
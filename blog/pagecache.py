@@ -0,0 +1,82 @@
+import hashlib
+
+from django.conf import settings
+from .cache import blog_cache, bump_version, get_version
+
+# Для каждого маршрута - параметры строки запроса, которые влияют на
+# страницу. Остальные параметры (метки рекламы и т.п.) в ключ не входят.
+CACHED_ROUTES = {
+    'blog:post_list': ('page', 'cursor'),
+    'blog:post_list_by_tag': ('page', 'cursor'),
+    'blog:tag_list': ('page',),
+    'blog:post_archive_year': (),
+    'blog:post_archive_month': ('cursor',),
+    'blog:post_detail': (),
+    'blog:post_feed': (),
+    'sitemap_index': (),
+    'sitemap_section': ('p',),
+}
+
+
+def page_groups(match):
+    '''
+    Группы инвалидации для страницы по результату resolve().
+    Ключ страницы включает версии всех ее групп, поэтому сброс группы
+    делает недействительными только зависящие от нее страницы.
+    '''
+    if match.view_name == 'blog:post_list':
+        return ['list']
+    if match.view_name == 'blog:post_list_by_tag':
+        return ['tag:{}'.format(match.kwargs['tag_slug'])]
+    if match.view_name == 'blog:post_detail':
+        return ['detail:{year}/{month}/{day}/{post}'.format(**match.kwargs)]
+    if match.view_name == 'blog:post_feed':
+        return ['feed']
+    if match.view_name == 'blog:tag_list':
+        return ['tags']
+    if match.view_name in ('blog:post_archive_year', 'blog:post_archive_month'):
+        return ['archive']
+    return ['sitemap']
+
+
+def page_cache_key(request, match):
+    '''Ключ страницы: путь, значимые параметры и версии групп'''
+    params = sorted((name, value)
+                    for name in CACHED_ROUTES[match.view_name]
+                    for value in request.GET.getlist(name))
+    url = '{}?{}'.format(request.path, params)
+    versions = '.'.join(str(get_version(group)) for group in page_groups(match))
+    return 'blog:page:{}:{}'.format(hashlib.md5(url.encode()).hexdigest(), versions)
+
+
+def get_page(key):
+    return blog_cache().get(key)
+
+
+def set_page(key, response):
+    blog_cache().set(key, response, getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 300))
+
+
+def detail_group(publish, slug):
+    return 'detail:{}/{}/{}/{}'.format(publish.year, publish.month, publish.day, slug)
+
+
+def invalidate_post_pages(post, tag_slugs=()):
+    '''
+    Сбрасывает страницы, на которых видна статья: ее страницу (в том
+    числе по старому адресу, если сменились дата или slug), списки,
+    страницы ее тегов, архив, RSS и карту сайта.
+    '''
+    groups = {'list', 'feed', 'sitemap', 'archive', detail_group(post.publish, post.slug)}
+    loaded = getattr(post, '_loaded_values', None) or {}
+    if loaded.get('publish') and loaded.get('slug'):
+        groups.add(detail_group(loaded['publish'], loaded['slug']))
+    groups.update('tag:{}'.format(slug) for slug in tag_slugs)
+    for group in groups:
+        bump_version(group)
+
+
+def invalidate_comment_pages(comment):
+    '''Комментарии видны только на странице статьи'''
+    post = comment.post
+    bump_version(detail_group(post.publish, post.slug))
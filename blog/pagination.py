@@ -0,0 +1,158 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+# С какого количества строк EstimatedCountPaginator перестает считать точно
+ESTIMATE_THRESHOLD = 10000
+
+
+class InvalidCursor(Exception):
+    '''Курсор поврежден или не может быть разобран'''
+
+
+def encode_cursor(post, direction):
+    '''Упаковывает позицию (publish, id) и направление в непрозрачную строку'''
+    payload = json.dumps({'p': post.publish.isoformat(), 'i': post.id,
+                          'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''Возвращает (publish, id, direction) или вызывает InvalidCursor'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        publish = parse_datetime(payload['p'])
+        post_id = int(payload['i'])
+        direction = payload['d']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if publish is None or direction not in ('next', 'prev'):
+        raise InvalidCursor(cursor)
+    return publish, post_id, direction
+
+
+class CursorPage:
+    '''
+    Страница курсорной пагинации. Повторяет ту часть интерфейса Page,
+    которой пользуются шаблоны, но не знает номера страницы и их общего
+    количества.
+    '''
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    '''
+    Пагинация по ключу (publish, id) вместо OFFSET.
+    Каждая страница - это один запрос с условием по ключу и LIMIT,
+    поэтому глубокие страницы стоят столько же, сколько первая,
+    а COUNT(*) не нужен совсем.
+    '''
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        '''Страница после/до курсора; без курсора или с битым - первая'''
+        try:
+            position = decode_cursor(cursor) if cursor else None
+        except InvalidCursor:
+            position = None
+        if position is None:
+            return self._forward(self.object_list, first=True)
+        publish, post_id, direction = position
+        if direction == 'next':
+            after = self.object_list.filter(
+                Q(publish__lt=publish) | Q(publish=publish, id__lt=post_id))
+            return self._forward(after, first=False)
+        before = self.object_list.filter(
+            Q(publish__gt=publish) | Q(publish=publish, id__gt=post_id))
+        return self._backward(before)
+
+    def _forward(self, queryset, first):
+        rows = list(queryset.order_by('-publish', '-id')[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return self._page(rows, has_next, has_previous=not first and bool(rows))
+
+    def _backward(self, queryset):
+        rows = list(queryset.order_by('publish', 'id')[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        if not rows:
+            # Перед курсором ничего нет - показываем первую страницу
+            return self._forward(self.object_list, first=True)
+        return self._page(rows, True, has_previous)
+
+    def _page(self, rows, has_next, has_previous):
+        next_cursor = encode_cursor(rows[-1], 'next') if rows and has_next else None
+        previous_cursor = encode_cursor(rows[0], 'prev') if rows and has_previous else None
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def estimated_count(queryset):
+    '''
+    Оценка количества строк без COUNT(*): для всей таблицы - из
+    статистики pg_class.reltuples, для выборки с условиями - оценка
+    планировщика из EXPLAIN. Оценки обновляются ANALYZE (autovacuum).
+    '''
+    with connections[queryset.db].cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return row[0] if row else -1
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            # queryset.none() и условия, которые заведомо ничего не находят
+            return 0
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator для больших таблиц (списки в админке): если по оценке
+    строк не меньше ESTIMATE_THRESHOLD, количество берется из оценки
+    PostgreSQL, а не из COUNT(*). Номера последних страниц при этом
+    приблизительные. Маленькие выборки считаются точно.
+    '''
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate >= ESTIMATE_THRESHOLD:
+            return estimate
+        return super().count
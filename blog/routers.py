@@ -0,0 +1,71 @@
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Модели опубликованного контента, которые можно читать с реплик.
+# Остальное (очередь писем, пользователи, сессии) всегда читается с основной БД.
+REPLICA_MODELS = {'blog.post', 'blog.comment', 'blog.similarpost',
+                  'taggit.tag', 'taggit.taggeditem'}
+PIN_SESSION_KEY = '_blog_primary_until'
+
+# Чтение с реплик разрешается только на время GET/HEAD запроса
+# (ReplicaRoutingMiddleware). Команды, сигналы и запросы на запись
+# читают с основной БД.
+_replica_reads = contextvars.ContextVar('blog_replica_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'BLOG_DB_REPLICAS', ())
+
+
+def allow_replica_reads(allowed):
+    _replica_reads.set(allowed)
+
+
+def is_pinned(request):
+    '''Сессия недавно что-то записала и должна читать с основной БД'''
+    # Сессию трогаем только если есть cookie, иначе ответ получит Vary: Cookie
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return False
+    return request.session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def pin_to_primary(request):
+    '''После записи (например, комментария) сессия читает с основной БД'''
+    request.session[PIN_SESSION_KEY] = time.time() + getattr(
+        settings, 'BLOG_REPLICA_PIN_SECONDS', 300)
+
+
+class PrimaryReplicaRouter:
+    '''
+    Запись и чтение вне запросов - основная БД (default). Чтение
+    опубликованного контента в GET запросах - случайная реплика из
+    BLOG_DB_REPLICAS, если сессия не закреплена за основной БД.
+    Внутри транзакции на основной БД читаем с нее же, чтобы видеть
+    только что записанное.
+    '''
+
+    def db_for_read(self, model, **hints):
+        if (_replica_reads.get() and replicas()
+                and model._meta.label_lower in REPLICA_MODELS
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return random.choice(replicas())
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
@@ -0,0 +1,239 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag
+from .models import Post, SimilarPost, Comment
+from .archive import change_month_count, month_of
+from .cache import bump_version
+from .conditions import mark_post_removed
+from .counters import change_comments_count
+from .pagecache import invalidate_comment_pages, invalidate_post_pages
+from .similar import refresh_or_queue, update_similar_posts
+from .tagstats import TAGS, change_tag_counts
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    '''Похожие статьи зависят от статуса и даты публикации'''
+    if raw:
+        return
+    if created or instance.field_changed('status') or instance.field_changed('publish'):
+        update_similar_posts(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(sender, instance, action, pk_set=None, **kwargs):
+    '''Теги статьи добавлены или удалены'''
+    if not isinstance(instance, Post):
+        return
+    if action in ('post_add', 'post_remove') and pk_set or action == 'post_clear':
+        update_similar_posts(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    '''Запоминаем статьи, в списках которых была удаляемая статья'''
+    instance._similar_affected = set(SimilarPost.objects.filter(similar_id=instance.id)
+                                     .values_list('post_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    refresh_or_queue(getattr(instance, '_similar_affected', ()))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    '''Поддерживаем Post.comments_count: учитываются только активные'''
+    if raw:
+        return
+    old_post_id, old_active = getattr(instance, '_loaded_counted', (None, False))
+    new_post_id, new_active = instance.post_id, instance.active
+    if (old_post_id, old_active) != (new_post_id, new_active):
+        if old_active:
+            change_comments_count(old_post_id, -1)
+        if new_active:
+            change_comments_count(new_post_id, 1)
+    instance._loaded_counted = (new_post_id, new_active)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    post_id, active = getattr(instance, '_loaded_counted',
+                              (instance.post_id, instance.active))
+    if active:
+        change_comments_count(post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_sidebar(sender, **kwargs):
+    '''Боковая панель показывает статьи и счетчики комментариев'''
+    if kwargs.get('raw'):
+        return
+    bump_version('sidebar')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_posts(sender, **kwargs):
+    '''Версия контента: от нее зависят закэшированные результаты поиска и подсказки'''
+    if kwargs.get('raw'):
+        return
+    bump_version('posts')
+    bump_version('suggest')
+
+
+def tag_slugs(post, tag_ids=()):
+    '''Slug текущих тегов статьи и тегов с id из tag_ids'''
+    slugs = set(post.tags.values_list('slug', flat=True))
+    if tag_ids:
+        slugs.update(Tag.objects.filter(id__in=tag_ids).values_list('slug', flat=True))
+    return slugs
+
+
+@receiver(post_save, sender=Post)
+def post_pages_changed(sender, instance, raw=False, **kwargs):
+    '''Сброс закэшированных страниц, где видна статья'''
+    if not raw:
+        invalidate_post_pages(instance, tag_slugs(instance))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tag_pages_changed(sender, instance, action, pk_set=None, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_slugs = tag_slugs(instance)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        invalidate_post_pages(instance, tag_slugs(instance, pk_set))
+    elif action == 'post_clear':
+        invalidate_post_pages(instance, getattr(instance, '_cleared_tag_slugs', ()))
+
+
+@receiver(pre_delete, sender=Post)
+def post_pages_deleting(sender, instance, **kwargs):
+    # Теги удаляются вместе со статьей, запоминаем их заранее
+    instance._deleted_tag_slugs = tag_slugs(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_pages_deleted(sender, instance, **kwargs):
+    invalidate_post_pages(instance, getattr(instance, '_deleted_tag_slugs', ()))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_pages_changed(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        invalidate_comment_pages(instance)
+
+
+def published_in_db(post):
+    '''Опубликована ли статья по последнему сохраненному состоянию'''
+    return getattr(post, '_loaded_values', {}).get('status', post.status) == 'published'
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tag_stats_changed(sender, instance, action, pk_set=None, **kwargs):
+    '''Счетчики тегов: статья получила или потеряла теги'''
+    if not isinstance(instance, Post) or not published_in_db(instance):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = set(instance.tags.values_list('id', flat=True))
+    elif action == 'post_add':
+        change_tag_counts(pk_set, 1)
+    elif action == 'post_remove':
+        change_tag_counts(pk_set, -1)
+    elif action == 'post_clear':
+        change_tag_counts(getattr(instance, '_cleared_tag_ids', ()), -1)
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Подсказки показывают только теги опубликованных статей
+        bump_version('suggest')
+
+
+@receiver(post_save, sender=Post)
+def post_tag_stats_status(sender, instance, created, raw=False, **kwargs):
+    '''Статья опубликована или снята с публикации'''
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if raw or created or 'status' not in loaded:
+        return
+    was_published = loaded['status'] == 'published'
+    if was_published != (instance.status == 'published'):
+        change_tag_counts(set(instance.tags.values_list('id', flat=True)),
+                          1 if instance.status == 'published' else -1)
+
+
+@receiver(pre_delete, sender=Post)
+def post_tag_stats_deleting(sender, instance, **kwargs):
+    if published_in_db(instance):
+        instance._counted_tag_ids = set(instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def post_tag_stats_deleted(sender, instance, **kwargs):
+    change_tag_counts(getattr(instance, '_counted_tag_ids', ()), -1)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    '''Имя и slug тега видны в облаке и списке тегов'''
+    if not kwargs.get('raw'):
+        bump_version(TAGS)
+
+
+@receiver(post_save, sender=Post)
+def post_unpublished(sender, instance, created, raw=False, **kwargs):
+    '''RSS и карта сайта: статья снята с публикации'''
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if not raw and not created and loaded.get('status') == 'published' \
+            and instance.status != 'published':
+        mark_post_removed()
+
+
+@receiver(post_delete, sender=Post)
+def post_removed(sender, instance, **kwargs):
+    if published_in_db(instance):
+        mark_post_removed()
+
+
+@receiver(post_save, sender=Post)
+def post_archive_changed(sender, instance, created, raw=False, **kwargs):
+    '''Счетчики архива: статья опубликована, снята или перенесена на другой месяц'''
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if not created and not {'status', 'publish'} <= set(loaded):
+        return
+    old = month_of(loaded['publish']) if loaded.get('status') == 'published' else None
+    new = month_of(instance.publish) if instance.status == 'published' else None
+    if old != new:
+        if old:
+            change_month_count(*old, -1)
+        if new:
+            change_month_count(*new, 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_archive_deleted(sender, instance, **kwargs):
+    if published_in_db(instance):
+        loaded = getattr(instance, '_loaded_values', None) or {}
+        change_month_count(*month_of(loaded.get('publish', instance.publish)), -1)
+
+
+def invalidate_bulk_changes(tag_slugs=()):
+    '''
+    Сброс кэша после массовых изменений в обход сигналов (bulk_create,
+    SQL в командах): данные боковой панели, поиска, подсказок и тегов,
+    списки, архив, RSS, карта сайта и страницы тегов из tag_slugs.
+    Остальное содержимое общего кэша не трогается.
+    '''
+    for namespace in {'sidebar', 'posts', 'suggest', TAGS,
+                      'list', 'feed', 'sitemap', 'archive', 'tags'}:
+        bump_version(namespace)
+    for slug in set(tag_slugs):
+        bump_version('tag:{}'.format(slug))
+    # Даты изменения в загруженных данных могут быть старше MAX(updated)
+    mark_post_removed()
@@ -0,0 +1,108 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Min
+from taggit.models import TaggedItem
+from .models import Post, SimilarPost, StaleSimilarPost
+
+# Сколько похожих статей хранится и показывается для каждой статьи
+SIMILAR_POSTS_COUNT = 4
+# Сколько затронутых списков пересчитывается прямо в запросе
+SIMILAR_REFRESH_LIMIT = 20
+
+
+def post_tag_ids(post_id):
+    '''Подзапрос с id тегов статьи'''
+    return TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Post),
+        object_id=post_id).values('tag_id')
+
+
+def find_similar_posts(post_id):
+    '''
+    Тот же запрос, что раньше выполнялся на каждой странице статьи:
+    опубликованные статьи с общими тегами, сначала с наибольшим
+    количеством общих тегов, затем более новые.
+    Возвращает список пар (id, количество общих тегов).
+    '''
+    return list(Post.published.filter(tags__in=post_tag_ids(post_id))
+                .exclude(id=post_id)
+                .annotate(same_tags=Count('tags'))
+                .order_by('-same_tags', '-publish')
+                .values_list('id', 'same_tags')[:SIMILAR_POSTS_COUNT])
+
+
+def refresh_similar_posts(post_ids):
+    '''Пересчитывает сохраненные списки похожих статей для post_ids'''
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    links = []
+    for post_id in Post.published.filter(id__in=post_ids).values_list('id', flat=True):
+        for rank, (similar_id, same_tags) in enumerate(find_similar_posts(post_id), 1):
+            links.append(SimilarPost(post_id=post_id, similar_id=similar_id,
+                                     rank=rank, same_tags=same_tags))
+    with transaction.atomic():
+        SimilarPost.objects.filter(post_id__in=post_ids).delete()
+        SimilarPost.objects.bulk_create(links)
+        StaleSimilarPost.objects.filter(post_id__in=post_ids).delete()
+
+
+def refresh_or_queue(post_ids, first=None):
+    '''
+    Пересчитывает список статьи first и не больше SIMILAR_REFRESH_LIMIT
+    списков из post_ids (сначала более новые статьи). Остальные ставятся
+    в очередь StaleSimilarPost: популярный тег не заставляет запрос
+    админки пересчитывать все статьи с этим тегом.
+    '''
+    post_ids = sorted(set(post_ids) - {first}, reverse=True)
+    now = post_ids[:SIMILAR_REFRESH_LIMIT]
+    refresh_similar_posts(now + [first] if first else now)
+    queue_similar_posts(post_ids[SIMILAR_REFRESH_LIMIT:])
+
+
+def queue_similar_posts(post_ids):
+    '''Помечает списки статей устаревшими (rebuild_similar_posts --stale)'''
+    StaleSimilarPost.objects.bulk_create(
+        [StaleSimilarPost(post_id=post_id) for post_id in post_ids], ignore_conflicts=True)
+
+
+def posts_sharing_tags(post_ids):
+    '''id других опубликованных статей, у которых есть общий тег с post_ids'''
+    content_type = ContentType.objects.get_for_model(Post)
+    return TaggedItem.objects.filter(
+        content_type=content_type,
+        tag_id__in=TaggedItem.objects.filter(content_type=content_type,
+                                             object_id__in=post_ids).values('tag_id'),
+        object_id__in=Post.published.values('id'),
+    ).exclude(object_id__in=post_ids).order_by().values_list('object_id', flat=True).distinct()
+
+
+def posts_affected_by(post):
+    '''
+    Статьи, чей список похожих может измениться из-за post.
+    Это статьи, где post уже есть в списке, и статьи с общими тегами,
+    в список которых post может попасть: список неполный или у post не
+    меньше общих тегов, чем у последней статьи в нем.
+    '''
+    affected = set(SimilarPost.objects.filter(similar_id=post.id)
+                   .values_list('post_id', flat=True))
+    if post.status != 'published':
+        return affected
+    overlap = dict(TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Post),
+        tag_id__in=post_tag_ids(post.id),
+        object_id__in=Post.published.exclude(id=post.id).values('id'),
+    ).values('object_id').annotate(n=Count('id')).values_list('object_id', 'n'))
+    weakest = {row['post_id']: row['weakest'] for row in
+               SimilarPost.objects.filter(post_id__in=list(overlap))
+               .values('post_id')
+               .annotate(n=Count('id'), weakest=Min('same_tags'))
+               if row['n'] >= SIMILAR_POSTS_COUNT}
+    affected.update(post_id for post_id, n in overlap.items()
+                    if post_id not in weakest or n >= weakest[post_id])
+    return affected
+
+
+def update_similar_posts(post):
+    '''Обновляет список самой статьи и затронутых ей статей'''
+    refresh_or_queue(posts_affected_by(post), first=post.id)
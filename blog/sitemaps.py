@@ -1,12 +1,116 @@
+import math
+from datetime import MAXYEAR, datetime
+
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps.views import sitemap
+from django.contrib.sites.shortcuts import get_current_site
+from django.db.models import Count, Max
+from django.http import Http404
+from django.db.models.functions import TruncMonth
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import condition
+from .cache import get_or_set
+from .conditions import latest_post_modified, with_removals
 from .models import Post
 
+
+def valid_month(year, month):
+    '''Можно ли построить диапазон месяца (год и месяц из URL не проверены)'''
+    return 1 <= year < MAXYEAR and 1 <= month <= 12
+
+
+def month_range(year, month):
+    '''Начало месяца и начало следующего месяца в текущей зоне'''
+    if not valid_month(year, month):
+        raise Http404('No such month')
+    start = timezone.make_aware(datetime(year, month, 1))
+    if month == 12:
+        end = timezone.make_aware(datetime(year + 1, 1, 1))
+    else:
+        end = timezone.make_aware(datetime(year, month + 1, 1))
+    return start, end
+
+
 class PostSitemap(Sitemap):
+    '''
+    Часть карты сайта со статьями одного месяца.
+    items() возвращает легкие кортежи (slug, publish, updated) вместо
+    объектов модели: тексты статей не читаются из БД.
+    '''
     changefreq = 'weekly'
     priority = 0.9
 
+    def __init__(self, year=None, month=None):
+        self.year = year
+        self.month = month
+
     def items(self):
-        return Post.published.all()
+        posts = Post.published.order_by('publish', 'id')
+        if self.year is not None:
+            start, end = month_range(self.year, self.month)
+            posts = posts.filter(publish__gte=start, publish__lt=end)
+        return posts.values_list('slug', 'publish', 'updated', named=True)
+
+    def location(self, item):
+        return reverse('blog:post_detail', args=[item.publish.year,
+                                                 item.publish.month,
+                                                 item.publish.day,
+                                                 item.slug])
+
+    def lastmod(self, item):
+        return item.updated
+
+
+def month_shards():
+    '''
+    Месяцы со статьями: количество статей и время последнего изменения.
+    Группировка всей таблицы выполняется один раз на версию 'posts',
+    которая меняется при сохранении любой статьи.
+    '''
+    return list(Post.published.annotate(month=TruncMonth('publish')).order_by('month')
+                .values('month').annotate(lastmod=Max('updated'), count=Count('id')))
+
+
+def sitemap_shards():
+    '''Части карты сайта: месяц и страница ?p= внутри месяца'''
+    shards = []
+    for shard in get_or_set('posts', 'sitemap-shards', month_shards):
+        pages = math.ceil(shard['count'] / PostSitemap.limit)
+        for page in range(1, pages + 1):
+            shards.append({'month': shard['month'], 'lastmod': shard['lastmod'],
+                           'page': page})
+    return shards
+
+
+@condition(last_modified_func=latest_post_modified)
+def sitemap_index(request):
+    '''Индекс карты сайта: по одной части на месяц и страницу месяца'''
+    # Адреса строятся от домена из django.contrib.sites, как и в самих частях
+    domain = '{}://{}'.format(request.scheme, get_current_site(request).domain)
+    shards = []
+    for shard in sitemap_shards():
+        location = domain + reverse('sitemap_section', args=[shard['month'].year,
+                                                             shard['month'].month])
+        if shard['page'] > 1:
+            location += '?p={}'.format(shard['page'])
+        shards.append({'location': location, 'lastmod': shard['lastmod']})
+    return render(request, 'blog/sitemap_index.xml', {'shards': shards},
+                  content_type='application/xml')
+
+
+def section_last_modified(request, year, month):
+    if not valid_month(year, month):
+        return None
+    start, end = month_range(year, month)
+    return with_removals(Post.published.filter(publish__gte=start, publish__lt=end)
+                         .aggregate(latest=Max('updated'))['latest'])
+
 
-    def lastmod(self, obj):
-        return obj.updated
\ No newline at end of file
+@condition(last_modified_func=section_last_modified)
+def sitemap_section(request, year, month):
+    '''Часть карты сайта за месяц, внутри части работает ?p= по 50000 адресов'''
+    if not valid_month(year, month):
+        raise Http404('No such month')
+    return sitemap(request, {'posts': PostSitemap(year, month)})
@@ -0,0 +1,54 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from taggit.models import TaggedItem
+from .cache import bump_version
+from .models import Post, TagStat
+
+# Пространство имен кэша для облака и списка тегов
+TAGS = 'tags'
+# Количество размеров шрифта в облаке тегов
+CLOUD_WEIGHTS = 5
+
+
+def change_tag_counts(tag_ids, delta):
+    '''Атомарно меняет счетчики опубликованных статей у тегов на delta'''
+    if not tag_ids:
+        return
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id) for tag_id in tag_ids],
+                                ignore_conflicts=True)
+    TagStat.objects.filter(tag_id__in=tag_ids)\
+        .update(published_count=Greatest(F('published_count') + delta, 0))
+    bump_version(TAGS)
+
+
+def recount_tag_stats():
+    '''Пересчитывает все счетчики по таблице связей taggit'''
+    content_type = ContentType.objects.get_for_model(Post)
+    counts = TaggedItem.objects.filter(content_type=content_type,
+                                       object_id__in=Post.published.values('id'))\
+        .order_by().values('tag_id').annotate(n=Count('id')).values_list('tag_id', 'n')
+    with transaction.atomic():
+        TagStat.objects.all().delete()
+        stats = TagStat.objects.bulk_create(
+            [TagStat(tag_id=tag_id, published_count=n) for tag_id, n in counts])
+    bump_version(TAGS)
+    return len(stats)
+
+
+def tag_cloud(count):
+    '''
+    Самые популярные теги по алфавиту, weight от 1 до CLOUD_WEIGHTS
+    пропорционально количеству статей.
+    '''
+    stats = list(TagStat.objects.filter(published_count__gt=0).select_related('tag')
+                 .order_by('-published_count', 'tag__name')[:count])
+    if not stats:
+        return []
+    smallest = stats[-1].published_count
+    spread = max(stats[0].published_count - smallest, 1)
+    return sorted(({'name': stat.tag.name, 'slug': stat.tag.slug,
+                    'count': stat.published_count,
+                    'weight': 1 + (stat.published_count - smallest) * (CLOUD_WEIGHTS - 1) // spread}
+                   for stat in stats), key=lambda tag: tag['name'].lower())
@@ -1,29 +1,65 @@
 from django import template
-from ..models import Post
-from django.db.models import Count
+from ..cache import get_or_set
+from ..models import ArchiveMonth, Post
+from ..tagstats import TAGS, tag_cloud
 from django.utils.safestring import mark_safe
-import markdown
+from ..markup import render_markdown
 
 register = template.Library()
 
+# Данные боковой панели кэшируются в пространстве имен 'sidebar',
+# версия которого увеличивается при изменении статей и комментариев
+SIDEBAR = 'sidebar'
+
+# Поля, которых достаточно для ссылки на статью
+LINK_FIELDS = ('id', 'title', 'slug', 'publish')
+
 # Тег с колличеством опубликованных статей
 @register.simple_tag
 def total_post():
-    return Post.published.count()
+    return get_or_set(SIDEBAR, 'total_post', Post.published.count)
 
 # Тег добавления новых статей на боковую панель
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
+    latest_posts = get_or_set(
+        SIDEBAR, 'latest_posts:{}'.format(count),
+        lambda: list(Post.published.only(*LINK_FIELDS).order_by('-publish')[:count]))
     return {'latest_posts': latest_posts}
 
-# Добавляем к каждой статье количество ее комментариев
+# Самые комментируемые статьи по счетчику comments_count,
+# запрос идет по частичному индексу без агрегации комментариев
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    return Post.published.annotate(total_comments = Count('comments')
-                                   ).order_by('-total_comments')[:count]
+    return get_or_set(
+        SIDEBAR, 'most_commented:{}'.format(count),
+        lambda: list(Post.published.only(*LINK_FIELDS)
+                     .order_by('-comments_count', '-publish')[:count]))
+
+# Архив: последние месяцы с количеством статей из ArchiveMonth
+@register.inclusion_tag('blog/post/archive_months.html')
+def show_archive(count=12):
+    months = get_or_set(
+        SIDEBAR, 'archive:{}'.format(count),
+        lambda: list(ArchiveMonth.objects.filter(published_count__gt=0)[:count]))
+    return {'archive_months': months}
+
+# Облако популярных тегов по счетчикам TagStat
+@register.inclusion_tag('blog/post/tag_cloud.html')
+def show_tag_cloud(count=20):
+    return {'cloud_tags': get_or_set(TAGS, 'cloud:{}'.format(count),
+                                     lambda: tag_cloud(count))}
+
+# Строка запроса текущей страницы с замененными параметрами,
+# нужна для ссылок пагинации, чтобы не терять, например, query поиска
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        query[key] = value
+    return query.urlencode()
 
 #
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
\ No newline at end of file
+    return mark_safe(render_markdown(text))
\ No newline at end of file
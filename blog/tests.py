@@ -1,3 +1,1287 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import smtplib
+import socketserver
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.asgi import get_asgi_application
+from django.core.signals import request_finished, request_started
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.backends import signals
+from asgiref.sync import async_to_sync
+from psycopg2 import OperationalError, extensions
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from django.utils import timezone
+
+from . import async_views, bench
+from .cache import blog_cache
+from .counters import drifted_posts, recount_comments
+from .mail import MAX_ATTEMPTS, enqueue_mail, send_queued_mail
+from .middleware import ReplicaRoutingMiddleware
+from .archive import recount_archive
+from .pagination import EstimatedCountPaginator
+from .models import ArchiveMonth, Post, Comment, QueuedEmail, StaleSimilarPost, TagStat
+from .routers import PIN_SESSION_KEY, PrimaryReplicaRouter, allow_replica_reads
+from .similar import find_similar_posts
+from .tagstats import recount_tag_stats
+from .templatetags.blog_tags import get_most_commented_posts, show_tag_cloud, total_post
+from .views import ranked_post_ids, search_results
+from yoga.db.pooled.pool import ConnectionPool
+
+
+class PostRenderingTests(TestCase):
+    '''HTML, анонс и вектор поиска, сохраняемые вместе со статьей'''
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, title, body):
+        return Post.objects.create(title=title, slug=title.lower(), author=self.author,
+                                   body=body, status='published')
+
+    def test_markdown_rendered_on_save(self):
+        post = self.create_post('Markdown', '*Django* ' + 'word ' * 40)
+        self.assertIn('<em>Django</em>', post.body_html)
+        self.assertTrue(post.excerpt.startswith('<p><em>Django</em>'))
+        self.assertTrue(post.excerpt.endswith(' …</p>'))
+        self.assertEqual(Post.objects.get(id=post.id).body_html, post.body_html)
+
+    def saved_queries(self, post):
+        '''SQL сохранения статьи без запросов обработчиков сигналов'''
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        return [query['sql'] for query in queries
+                if query['sql'].startswith('UPDATE "blog_post"')
+                or '"blog_post"."body"' in query['sql']
+                or '"blog_post"."comments_count"' in query['sql']]
+
+    def test_save_writes_vector_in_one_statement(self):
+        post = self.create_post('Markdown', 'Text')
+        post = Post.objects.get(id=post.id)
+        post.title = 'Templates'
+        sql, = self.saved_queries(post)
+        self.assertIn('"search_vector" =', sql)
+        self.assertTrue(Post.objects.filter(id=post.id, search_vector='templates').exists())
+
+    def test_deferred_save_does_not_reload_fields(self):
+        post = self.create_post('Markdown', 'Text')
+        Post.objects.filter(id=post.id).update(comments_count=3)
+        post = Post.objects.only('id', 'status').get(id=post.id)
+        post.status = 'draft'
+        sql, = self.saved_queries(post)
+        self.assertNotIn('search_vector', sql)
+        post = Post.objects.get(id=post.id)
+        self.assertEqual((post.status, post.comments_count, post.title),
+                         ('draft', 3, 'Markdown'))
+
+    def test_save_recreates_deleted_row(self):
+        post = self.create_post('Markdown', 'Text')
+        post = Post.objects.get(id=post.id)
+        Post.objects.filter(id=post.id).update(comments_count=2)
+        post.title = 'Templates'
+        sql, = self.saved_queries(post)
+        self.assertNotIn('comments_count', sql)
+        self.assertEqual(Post.objects.get(id=post.id).comments_count, 2)
+        # Строку удалили в другом запросе: как в Django, save() вставляет ее
+        Post.objects.filter(id=post.id).delete()
+        post.save()
+        self.assertEqual(Post.objects.get(id=post.id).title, 'Templates')
+
+    def test_render_posts_backfills_html(self):
+        post = self.create_post('Markdown', '**Bold**')
+        Post.objects.filter(id=post.id).update(body_html='', excerpt='')
+        call_command('render_posts', '--batch-size', '1', stdout=io.StringIO())
+        post = Post.objects.get(id=post.id)
+        self.assertEqual(post.body_html, '<p><strong>Bold</strong></p>')
+        self.assertEqual(post.excerpt, post.body_html)
+
+    def test_search_ranks_title_matches_first(self):
+        in_body = self.create_post('Body', 'Django ' * 20)
+        in_title = self.create_post('Django', 'Text')
+        self.create_post('Other', 'Text')
+        self.assertEqual(ranked_post_ids('django'), (False, [in_title.id, in_body.id]))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class PostListQueryCountTests(TestCase):
+    '''Количество запросов страницы списка не зависит от числа статей'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        for i in range(12):
+            post = Post.objects.create(title='Post {}'.format(i),
+                                       slug='post-{}'.format(i),
+                                       author=author, body='Text',
+                                       status='published')
+            post.tags.add('django', 'tag-{}'.format(i))
+
+    def count_queries(self, url, per_page):
+        with mock.patch('blog.views.POSTS_PER_PAGE', per_page):
+            # Первый запрос заполняет кэш боковой панели
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['posts']), per_page)
+        return len(queries)
+
+    def test_post_list_constant_queries(self):
+        url = reverse('blog:post_list')
+        self.assertEqual(self.count_queries(url, 2),
+                         self.count_queries(url, 10))
+
+    def test_tag_list_constant_queries(self):
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        self.assertEqual(self.count_queries(url, 2),
+                         self.count_queries(url, 10))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class CursorPaginationTests(TestCase):
+    '''Курсорная пагинация списка статей'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.posts = [Post.objects.create(title='Post {}'.format(i),
+                                         slug='post-{}'.format(i),
+                                         author=author, body='Text',
+                                         status='published')
+                     for i in range(7)]
+
+    def test_walks_all_posts_forward_and_back(self):
+        url = reverse('blog:post_list')
+        seen = []
+        pages = []
+        cursor = ''
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            page = response.context['posts']
+            pages.append(list(page))
+            seen.extend(page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual([p.id for p in seen],
+                         [p.id for p in sorted(self.posts, key=lambda p: (p.publish, p.id),
+                                               reverse=True)])
+        previous = self.client.get(url, {'cursor': page.previous_cursor})
+        self.assertEqual(list(previous.context['posts']), pages[-2])
+
+    def test_offset_pages_still_work(self):
+        response = self.client.get(reverse('blog:post_list'), {'page': 2})
+        self.assertEqual(response.context['posts'].number, 2)
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(reverse('blog:post_list'), {'cursor': '!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['posts'].has_previous())
+
+
+class SimilarPostsTests(TestCase):
+    '''Сохраненные похожие статьи совпадают с прямым запросом'''
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, slug, *tags, status='published'):
+        post = Post.objects.create(title=slug, slug=slug, author=self.author,
+                                   body='Text', status=status)
+        post.tags.add(*tags)
+        return post
+
+    def assertStored(self, post):
+        stored = list(post.similar_links.values_list('similar_id', 'same_tags'))
+        self.assertEqual(stored, find_similar_posts(post.id))
+
+    def test_follows_tag_and_status_changes(self):
+        posts = [self.create_post('a', 'x', 'y'),
+                 self.create_post('b', 'x'),
+                 self.create_post('c', 'y', 'z'),
+                 self.create_post('d', 'z', status='draft')]
+        a, b, c, d = posts
+        self.assertEqual([p.id for p in Post.published.filter(similar_to__post=a)],
+                         [c.id, b.id])
+        d.status = 'published'
+        d.save()
+        c.tags.remove('y')
+        b.tags.add('y')
+        a.delete()
+        for post in Post.objects.all():
+            self.assertStored(post)
+
+    def test_fan_out_is_bounded(self):
+        posts = [self.create_post('p{}'.format(i), 'popular') for i in range(8)]
+        StaleSimilarPost.objects.all().delete()
+        new = self.create_post('new')
+        with mock.patch('blog.similar.SIMILAR_REFRESH_LIMIT', 3), \
+                mock.patch('blog.similar.find_similar_posts',
+                           wraps=find_similar_posts) as find:
+            new.tags.add('popular')
+        # Сама статья и три самые новые из восьми затронутых
+        self.assertEqual(find.call_count, 4)
+        queued = set(StaleSimilarPost.objects.values_list('post_id', flat=True))
+        self.assertEqual(queued, {post.id for post in posts[:5]})
+        call_command('rebuild_similar_posts', '--stale', stdout=io.StringIO())
+        self.assertFalse(StaleSimilarPost.objects.exists())
+        for post in posts + [new]:
+            self.assertStored(post)
+
+
+class CommentCounterTests(TestCase):
+    '''Счетчик активных комментариев статьи'''
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='Post', slug='post', author=author,
+                                        body='Text', status='published')
+
+    def assertCount(self, expected):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, expected)
+
+    def test_create_deactivate_delete(self):
+        first = Comment.objects.create(post=self.post, name='a', email='a@a.com', body='1')
+        second = Comment.objects.create(post=self.post, name='b', email='b@b.com', body='2')
+        Comment.objects.create(post=self.post, name='c', email='c@c.com', body='3',
+                               active=False)
+        self.assertCount(2)
+        first.active = False
+        first.save()
+        first.save()
+        self.assertCount(1)
+        Comment.objects.get(pk=second.pk).delete()
+        first.delete()
+        self.assertCount(0)
+
+    def test_post_save_keeps_counter(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, name='a', email='a@a.com', body='1')
+        stale.title = 'New title'
+        stale.save()
+        self.assertCount(1)
+
+    def test_recount_repairs_drift(self):
+        Comment.objects.create(post=self.post, name='a', email='a@a.com', body='1')
+        Post.objects.update(comments_count=10)
+        self.assertEqual(list(drifted_posts()), [self.post])
+        recount_comments()
+        self.assertCount(1)
+
+
+class SidebarCacheTests(TestCase):
+    '''Кэш боковой панели сбрасывается при изменении статей и комментариев'''
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def create_post(self, slug):
+        return Post.objects.create(title=slug, slug=slug, author=self.author,
+                                   body='Text', status='published')
+
+    def test_cached_until_content_changes(self):
+        post = self.create_post('first')
+        self.assertEqual(total_post(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(total_post(), 1)
+        self.create_post('second')
+        self.assertEqual(total_post(), 2)
+        Comment.objects.create(post=post, name='a', email='a@a.com', body='1')
+        self.assertEqual(get_most_commented_posts(1), [post])
+
+
+class PageCacheTests(TestCase):
+    '''Кэш страниц для анонимных читателей'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='secret')
+        cls.post = Post.objects.create(title='First', slug='first', author=cls.author,
+                                       body='Text', status='published')
+        cls.post.tags.add('django')
+
+    def get(self, url):
+        return self.client.get(url).get('X-Page-Cache')
+
+    def test_list_cached_until_post_changes(self):
+        url = reverse('blog:post_list')
+        tag_url = reverse('blog:post_list_by_tag', args=['django'])
+        other_tag_url = reverse('blog:post_list_by_tag', args=['python'])
+        Post.objects.create(title='Other', slug='other', author=self.author,
+                            body='Text', status='published').tags.add('python')
+        for page in (url, tag_url, other_tag_url):
+            self.get(page)
+            self.assertEqual(self.get(page), 'hit')
+        self.post.title = 'Changed'
+        self.post.save()
+        self.assertIsNone(self.get(url))
+        self.assertIsNone(self.get(tag_url))
+        self.assertEqual(self.get(other_tag_url), 'hit')
+        self.assertContains(self.client.get(url), 'Changed')
+
+    def test_bypass_for_authenticated_and_post(self):
+        url = reverse('blog:post_feed')
+        self.get(url)
+        self.assertEqual(self.get(url), 'hit')
+        self.client.login(username='author', password='secret')
+        self.assertIsNone(self.get(url))
+
+    def test_forms_with_csrf_are_not_cached(self):
+        url = self.post.get_absolute_url()
+        self.get(url)
+        self.assertIsNone(self.get(url))
+
+
+class ConditionalGetTests(TestCase):
+    '''Ответ 304 для страницы статьи, RSS и карты сайта'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='First', slug='first', author=author,
+                                       body='Text', status='published')
+
+    def test_detail_etag_follows_comments(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        comment = Comment.objects.create(post=self.post, name='a', email='a@a.com', body='1')
+        etag = self.client.get(url)['ETag']
+        comment.active = False
+        comment.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_feed_and_sitemap_last_modified(self):
+        for url in (reverse('blog:post_feed'), '/sitemap.xml'):
+            last_modified = self.client.get(url)['Last-Modified']
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+    def test_feed_and_sitemap_follow_published_set(self):
+        urls = (reverse('blog:post_feed'), '/sitemap.xml')
+        draft = Post.objects.create(title='Draft', slug='draft', author=self.post.author,
+                                    body='Text', publish=self.post.publish)
+        last_modified = [self.client.get(url)['Last-Modified'] for url in urls]
+        later = timezone.now() + datetime.timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            draft.body = 'Edited'
+            draft.save()
+        for url, since in zip(urls, last_modified):
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            Post.objects.get(id=self.post.id).delete()
+        for url, since in zip(urls, last_modified):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, self.post.get_absolute_url())
+
+
+class SitemapTests(TestCase):
+    '''Карта сайта разбита на части по месяцам'''
+
+    def test_index_links_monthly_sections(self):
+        author = User.objects.create_user('author')
+        post = Post.objects.create(title='First', slug='first', author=author,
+                                   body='Text', status='published')
+        response = self.client.get(reverse('sitemap_index'))
+        section = reverse('sitemap_section', args=[post.publish.year, post.publish.month])
+        self.assertContains(response, section)
+        self.assertContains(self.client.get(section), post.get_absolute_url())
+
+    def test_large_months_are_paged_in_index(self):
+        author = User.objects.create_user('author')
+        for slug in ('first', 'second', 'third'):
+            post = Post.objects.create(title=slug, slug=slug, author=author,
+                                       body='Text', status='published')
+        section = reverse('sitemap_section', args=[post.publish.year, post.publish.month])
+        with mock.patch('blog.sitemaps.PostSitemap.limit', 2):
+            response = self.client.get(reverse('sitemap_index'))
+            self.assertContains(response, section + '<', count=1)
+            self.assertContains(response, section + '?p=2<', count=1)
+            self.assertNotContains(response, '?p=3')
+            self.assertEqual(self.client.get(section, {'p': 2}).status_code, 200)
+
+    def test_out_of_range_dates_are_not_found(self):
+        for year, month in ((0, 1), (10000, 1), (2020, 13)):
+            response = self.client.get('/sitemap-posts-{}-{}.xml'.format(year, month))
+            self.assertEqual(response.status_code, 404)
+
+
+class RefusingEmailBackend(BaseEmailBackend):
+    '''SMTP сервер, который отклоняет получателей'''
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPRecipientsRefused(
+            {to: (550, b'Mailbox unavailable') for message in email_messages for to in message.to})
+
+
+class DroppingEmailBackend(BaseEmailBackend):
+    '''SMTP сервер, который обрывает соединение'''
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    '''Минимальный SMTP сервер: принимает письма в server.messages'''
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost')
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    data.append(line)
+                self.server.messages.append(b''.join(data))
+                self.reply('250 Queued')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # EHLO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class MailQueueTests(TestCase):
+    '''Письма "поделиться статьей" уходят через очередь'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='First', slug='first', author=author,
+                                       body='Text', status='published')
+
+    def share(self):
+        return self.client.post(reverse('blog:post_share', args=[self.post.id]),
+                                {'name': 'Reader', 'email': 'reader@example.com',
+                                 'to': 'friend@example.com', 'comments': 'Look'})
+
+    def test_share_enqueues_and_worker_sends(self):
+        response = self.share()
+        self.assertTrue(response.context['sent'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.share()
+        self.assertEqual(send_queued_mail(), 2)
+        self.assertEqual([m.to for m in mail.outbox], [['friend@example.com']] * 2)
+        self.assertEqual(QueuedEmail.objects.filter(status='sent').count(), 2)
+        self.assertEqual(send_queued_mail(), 0)
+
+    @override_settings(EMAIL_BACKEND='blog.tests.RefusingEmailBackend')
+    def test_failures_are_retried_with_backoff(self):
+        self.share()
+        delays = []
+        for attempt in range(MAX_ATTEMPTS):
+            QueuedEmail.objects.update(next_attempt=timezone.now())
+            self.assertEqual(send_queued_mail(), 1)
+            email = QueuedEmail.objects.get()
+            delays.append(email.next_attempt - timezone.now())
+        self.assertEqual(email.status, 'failed')
+        self.assertEqual(email.attempts, MAX_ATTEMPTS)
+        self.assertLess(delays[0], delays[1])
+
+    @override_settings(EMAIL_BACKEND='blog.tests.DroppingEmailBackend')
+    def test_lost_connection_defers_rest_of_batch(self):
+        self.share()
+        self.share()
+        self.assertEqual(send_queued_mail(), 2)
+        self.assertEqual(list(QueuedEmail.objects.values_list('status', 'attempts')),
+                         [('queued', 0)] * 2)
+        self.assertFalse(QueuedEmail.objects.filter(next_attempt__lte=timezone.now()).exists())
+
+    def test_expired_lease_is_claimed_again(self):
+        stuck = enqueue_mail('Stuck', 'Text', 'admin@blog.com', 'a@example.com')
+        busy = enqueue_mail('Busy', 'Text', 'admin@blog.com', 'b@example.com')
+        QueuedEmail.objects.filter(id=stuck.id).update(
+            status='sending', next_attempt=timezone.now() - datetime.timedelta(minutes=1))
+        QueuedEmail.objects.filter(id=busy.id).update(
+            status='sending', next_attempt=timezone.now() + datetime.timedelta(minutes=5))
+        self.assertEqual(send_queued_mail(), 1)
+        self.assertEqual([m.subject for m in mail.outbox], ['Stuck'])
+        self.assertEqual(QueuedEmail.objects.get(id=busy.id).status, 'sending')
+
+
+class LocalSMTPTests(TestCase):
+    '''Доставка очереди через SMTP сервер на localhost'''
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), LocalSMTPHandler)
+        self.server.daemon_threads = True
+        self.server.messages = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_batch_sent_over_one_connection(self):
+        for i in range(3):
+            enqueue_mail('Post {}'.format(i), 'Text', 'admin@blog.com', 'friend@example.com')
+        host, port = self.server.server_address
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=host, EMAIL_PORT=port):
+            self.assertEqual(send_queued_mail(), 3)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertIn(b'Subject: Post 0', self.server.messages[0])
+        self.assertEqual(QueuedEmail.objects.filter(status='sent').count(), 3)
+
+    def test_server_down_defers_batch(self):
+        enqueue_mail('Post', 'Text', 'admin@blog.com', 'friend@example.com')
+        host, port = self.server.server_address
+        self.server.shutdown()
+        self.server.server_close()
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=host, EMAIL_PORT=port, EMAIL_TIMEOUT=1):
+            self.assertEqual(send_queued_mail(), 1)
+        email = QueuedEmail.objects.get()
+        # Недоступность сервера не считается попыткой
+        self.assertEqual((email.status, email.attempts), ('queued', 0))
+        self.assertGreater(email.next_attempt, timezone.now())
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class AsyncViewTests(TransactionTestCase):
+    '''
+    Асинхронные обработчики. Параллельные запросы идут через отдельные
+    соединения, поэтому данные должны быть зафиксированы в БД.
+    '''
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='First', slug='first', author=author,
+                                        body='Text', status='published')
+        self.post.tags.add('django')
+        other = Post.objects.create(title='Second', slug='second', author=author,
+                                    body='Text', status='published')
+        other.tags.add('django')
+        Comment.objects.create(post=self.post, name='a', email='a@a.com', body='Hello')
+        self.addCleanup(async_views.close_thread_connections)
+
+    def test_detail_loads_comments_and_similar_posts(self):
+        request = RequestFactory().get(self.post.get_absolute_url())
+        publish = self.post.publish
+        response = async_to_sync(async_views.post_detail)(
+            request, publish.year, publish.month, publish.day, self.post.slug)
+        self.assertContains(response, 'Hello')
+        self.assertContains(response, 'Second')
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_list(self):
+        request = RequestFactory().get(reverse('blog:post_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(async_views.post_list)(request)
+        self.assertContains(response, 'Second')
+        # Вся боковая панель заполнена в потоках, рендеринг не ждет БД
+        self.assertEqual(len(queries), 0)
+
+    def connections_created(self, requests):
+        request = RequestFactory().get(reverse('blog:post_list'))
+        async_views.close_thread_connections()
+        with mock.patch.object(signals.connection_created, 'send') as created:
+            for _ in range(requests):
+                async_to_sync(async_views.post_list)(request)
+        return created.call_count
+
+    def test_thread_connections_are_reused(self):
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=60):
+            # Не больше одного соединения на поток, а не по два на запрос
+            self.assertLessEqual(self.connections_created(5), settings.BLOG_ASYNC_DB_THREADS)
+
+    def test_thread_connections_follow_conn_max_age(self):
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0):
+            self.assertGreater(self.connections_created(5), settings.BLOG_ASYNC_DB_THREADS)
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0, BLOG_INSTRUMENTATION=True)
+class InstrumentationTests(TestCase):
+    '''Заголовок Server-Timing с количеством запросов и временем шаблонов'''
+
+    def test_server_timing_header(self):
+        author = User.objects.create_user('author')
+        Post.objects.create(title='First', slug='first', author=author,
+                            body='Text', status='published')
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        timing = response['Server-Timing']
+        self.assertIn('desc="{} queries"'.format(len(queries)), timing)
+        self.assertRegex(timing, r'tpl;dur=\d+\.\d')
+
+
+class ConnectionPoolTests(TestCase):
+    '''Соединения пула переиспользуются и возвращаются без транзакции'''
+
+    def setUp(self):
+        params = connection.get_connection_params()
+        params.pop('pool', None)
+        self.pool = ConnectionPool(params, min_size=1, max_size=1, timeout=0.1)
+        self.addCleanup(self.pool.close)
+
+    def test_connection_reused_after_rollback(self):
+        first = self.pool.checkout()
+        with first.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(first.get_transaction_status(),
+                         extensions.TRANSACTION_STATUS_INTRANS)
+        self.pool.checkin(first)
+        second = self.pool.checkout()
+        self.assertIs(second, first)
+        self.assertEqual(second.get_transaction_status(),
+                         extensions.TRANSACTION_STATUS_IDLE)
+        self.pool.checkin(second)
+
+    def test_exhausted_pool_times_out(self):
+        held = self.pool.checkout()
+        with self.assertRaises(OperationalError):
+            self.pool.checkout()
+        self.pool.checkin(held)
+
+    def test_closed_connection_replaced(self):
+        broken = self.pool.checkout()
+        self.pool.checkin(broken)
+        broken.close()
+        replacement = self.pool.checkout()
+        self.assertFalse(replacement.closed)
+        self.pool.checkin(replacement)
+
+    def test_terminated_backends_replaced(self):
+        params = connection.get_connection_params()
+        params.pop('pool', None)
+        pool = ConnectionPool(params, min_size=2, max_size=2, timeout=0.1, check_interval=0)
+        self.addCleanup(pool.close)
+        idle = [pool.checkout(), pool.checkout()]
+        pids = [conn.get_backend_pid() for conn in idle]
+        for conn in idle:
+            pool.checkin(conn)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(pid) FROM unnest(%s) AS pid', [pids])
+            for _ in range(100):
+                cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE pid = ANY(%s)',
+                               [pids])
+                if not cursor.fetchone()[0]:
+                    break
+                time.sleep(0.01)
+        # Оба свободных соединения мертвы, выдается новое
+        replacement = pool.checkout()
+        self.assertNotIn(replacement.get_backend_pid(), pids)
+        with replacement.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.checkin(replacement)
+
+
+@override_settings(BLOG_DB_REPLICAS=['missing_replica'], BLOG_PAGE_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    '''
+    Выбор БД роутером. Алиаса missing_replica нет: любое чтение с реплики
+    упало бы, поэтому успешный ответ значит, что читали с основной БД.
+    '''
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='First', slug='first', author=author,
+                                        body='Text', status='published')
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertIsNone(PrimaryReplicaRouter().db_for_read(Post))
+
+    def test_get_request_reads_published_content_from_replica(self):
+        router = PrimaryReplicaRouter()
+        middleware = ReplicaRoutingMiddleware(lambda request: None)
+        middleware.process_request(RequestFactory().get('/blog/'))
+        try:
+            self.assertEqual(router.db_for_read(Post), 'missing_replica')
+            self.assertIsNone(router.db_for_read(QueuedEmail))
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Post))
+        finally:
+            allow_replica_reads(False)
+
+    def test_comment_pins_session_to_primary(self):
+        url = self.post.get_absolute_url()
+        response = self.client.post(url, {'name': 'Reader', 'email': 'reader@example.com',
+                                          'body': 'Nice'})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.client.session[PIN_SESSION_KEY], time.time())
+        response = self.client.get(url)
+        self.assertContains(response, 'Nice')
+
+
+@skipUnless(settings.BLOG_DB_REPLICAS, 'BLOG_DB_REPLICA_HOSTS is not set')
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class ReplicaReadTests(TransactionTestCase):
+    '''Чтение через настоящий алиас реплики (зеркало default в тестах)'''
+    databases = {'default', *settings.BLOG_DB_REPLICAS}
+
+    def test_list_reads_from_replica(self):
+        author = User.objects.create_user('author')
+        Post.objects.create(title='First', slug='first', author=author,
+                            body='Text', status='published')
+        replica = connections[settings.BLOG_DB_REPLICAS[0]]
+        with CaptureQueriesContext(replica) as queries:
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, 'First')
+        self.assertTrue(any('blog_post' in query['sql'] for query in queries))
+
+
+class QueryIndexTests(TestCase):
+    '''
+    Частые запросы могут использовать индексы. На маленькой тестовой
+    таблице планировщик выбрал бы полный просмотр, поэтому он отключен.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='First', slug='first', author=author,
+                                       body='Text', status='published')
+        Comment.objects.create(post=cls.post, name='Reader',
+                               email='reader@example.com', body='Nice')
+
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_published_list_uses_index(self):
+        plan = self.explain(Post.published.order_by('-publish', '-id')[:3])
+        self.assertIn('blog_post_published_idx', plan)
+
+    def test_detail_lookup_uses_date_range_index(self):
+        publish = timezone.localtime(self.post.publish)
+        queryset = Post.published.by_date(publish.year, publish.month, publish.day, 'first')
+        self.assertEqual(list(queryset), [self.post])
+        # Диапазон дня попадает в условие индекса, а не в фильтр строк
+        self.assertRegex(self.explain(queryset), r'Index Cond: .*publish >=')
+
+    def test_invalid_date_is_not_found(self):
+        self.assertFalse(Post.published.by_date(2020, 2, 30, 'first').exists())
+        response = self.client.get('/blog/2020/2/30/first/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_active_comments_use_index(self):
+        plan = self.explain(self.post.comments.filter(active=True))
+        self.assertIn('blog_comment_active_idx', plan)
+
+
+class ImportExportTests(TestCase):
+    '''Выгрузка и повторная загрузка статей с тегами и комментариями'''
+
+    def setUp(self):
+        author = User.objects.create_user('author')
+        post = Post.objects.create(title='First', slug='first', author=author,
+                                   body='*Text*', status='published')
+        post.tags.add('django', 'python', 'web, http')
+        Comment.objects.create(post=post, name='Reader', email='reader@example.com',
+                               body='Nice')
+        Comment.objects.create(post=post, name='Spam', email='spam@example.com',
+                               body='Buy', active=False)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def round_trip(self, name):
+        path = os.path.join(self.directory.name, name)
+        call_command('export_posts', path, stdout=io.StringIO())
+        original = Post.objects.get()
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        call_command('import_posts', path, '--skip-similar', stdout=io.StringIO())
+        post = Post.objects.get()
+        self.assertEqual((post.slug, post.author.username), ('first', 'author'))
+        self.assertEqual(post.publish, original.publish)
+        self.assertEqual(post.created, original.created)
+        self.assertIn('<em>Text</em>', post.body_html)
+        self.assertEqual(sorted(post.tags.names()), ['django', 'python', 'web, http'])
+        self.assertEqual(post.comments.count(), 2)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(Post.objects.filter(search_vector='text').exists())
+        # Повторная загрузка не создает дубликатов
+        call_command('import_posts', path, '--skip-similar', stdout=io.StringIO())
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_jsonl_round_trip(self):
+        self.round_trip('posts.jsonl')
+
+    def test_csv_round_trip(self):
+        self.round_trip('posts.csv')
+
+    def test_similar_posts_queued_for_imported_posts(self):
+        path = os.path.join(self.directory.name, 'posts.jsonl')
+        call_command('export_posts', path, stdout=io.StringIO())
+        Post.objects.update(slug='old')
+        other = Post.objects.create(title='Other', slug='other', author=User.objects.get(),
+                                    body='Text', status='published')
+        other.tags.add('python')
+        StaleSimilarPost.objects.all().delete()
+        with mock.patch('blog.similar.find_similar_posts',
+                        wraps=find_similar_posts) as find:
+            call_command('import_posts', path, stdout=io.StringIO())
+        # Пересчет не выполняется при загрузке, статьи ставятся в очередь
+        self.assertEqual(find.call_count, 0)
+        self.assertEqual(set(StaleSimilarPost.objects.values_list('post_id', flat=True)),
+                         set(Post.objects.values_list('id', flat=True)))
+        call_command('rebuild_similar_posts', '--stale', stdout=io.StringIO())
+        imported = Post.objects.get(slug='first')
+        self.assertEqual(list(imported.similar_links.values_list('same_tags', flat=True)), [3, 1])
+        self.assertFalse(StaleSimilarPost.objects.exists())
+
+    def test_unknown_status_is_skipped(self):
+        path = os.path.join(self.directory.name, 'posts.jsonl')
+        call_command('export_posts', path, stdout=io.StringIO())
+        with open(path) as source:
+            record = json.loads(source.readline())
+        record.update(slug='hidden', status='archived')
+        with open(path, 'a') as target:
+            target.write(json.dumps(record) + '\n')
+        Post.objects.all().delete()
+        errors = io.StringIO()
+        call_command('import_posts', path, '--skip-similar', stdout=io.StringIO(), stderr=errors)
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ['first'])
+        self.assertIn('"hidden"', errors.getvalue())
+
+    def test_import_keeps_unrelated_cache(self):
+        blog_cache().set('unrelated', 1)
+        path = os.path.join(self.directory.name, 'posts.jsonl')
+        call_command('export_posts', path, stdout=io.StringIO())
+        Post.objects.all().delete()
+        call_command('import_posts', path, '--skip-similar', stdout=io.StringIO())
+        self.assertEqual(blog_cache().get('unrelated'), 1)
+
+
+class SuggestTests(TestCase):
+    '''Подсказки поиска и поиск по похожим заголовкам'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Django migrations', slug='django-migrations',
+                                       author=author, body='Text', status='published')
+        cls.post.tags.add('django')
+        draft = Post.objects.create(title='Django drafts', slug='django-drafts', author=author,
+                                    body='Text', status='draft')
+        draft.tags.add('django-draft')
+
+    def suggest(self, **params):
+        return self.client.get(reverse('blog:post_suggest'), params).json()
+
+    def test_titles_and_tags(self):
+        data = self.suggest(q='djan')
+        self.assertEqual(data['posts'], [{'title': 'Django migrations',
+                                          'url': self.post.get_absolute_url()}])
+        self.assertEqual([tag['name'] for tag in data['tags']], ['django'])
+
+    def test_tags_of_unpublished_posts_are_hidden(self):
+        self.assertNotIn('django-draft', [tag['name'] for tag in self.suggest(q='draft')['tags']])
+        self.assertEqual(len(self.suggest(q='djang')['tags']), 1)
+        post = Post.objects.get(id=self.post.id)
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self.suggest(q='djang')['tags'], [])
+
+    def test_short_query_and_limit(self):
+        self.assertEqual(self.suggest(q='d')['posts'], [])
+        with mock.patch('blog.views.SUGGEST_LIMIT', 1):
+            self.assertEqual(len(self.suggest(q='dj', limit=50)['tags']), 1)
+
+    def test_hot_queries_cached(self):
+        self.suggest(q='django')
+        with self.assertNumQueries(0):
+            self.suggest(q=' Django ')
+
+    @override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+    def test_search_falls_back_to_similar_titles(self):
+        response = self.client.get(reverse('blog:post_search'), {'query': 'djngo migratons'})
+        results = response.context['results']
+        self.assertTrue(results.fuzzy)
+        self.assertEqual(list(results), [self.post])
+
+
+class SearchCacheTests(TestCase):
+    '''Кэш результатов поиска по нормализованному запросу'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        for i in range(12):
+            Post.objects.create(title='Migrations {}'.format(i), slug='migrations-{}'.format(i),
+                                author=cls.author, body='Text', status='published')
+
+    def test_equivalent_queries_share_cached_ids(self):
+        first = search_results('Migrations', None)
+        self.assertEqual(first.paginator.count, 12)
+        self.assertEqual(len(first.object_list), 10)
+        # Нормализация запроса и загрузка статей страницы
+        with self.assertNumQueries(2):
+            second = search_results('  the MIGRATION ', '2')
+        self.assertEqual(second.paginator.count, 12)
+        self.assertEqual(len(second.object_list), 2)
+
+    def test_fuzzy_results_are_cached_by_query_text(self):
+        with mock.patch('blog.views.similar_title_ids', return_value=[]) as similar:
+            for query in ('Migratoins', 'the  migratoins', 'migratoins'):
+                self.assertTrue(search_results(query, None).fuzzy)
+        # Одинаковый tsquery, но разный текст для триграмм
+        self.assertEqual([call.args for call in similar.call_args_list],
+                         [('migratoins',), ('the migratoins',)])
+
+    def test_new_post_invalidates_results(self):
+        self.assertEqual(search_results('migrations', None).paginator.count, 12)
+        Post.objects.create(title='Migrations again', slug='migrations-again',
+                            author=self.author, body='Text', status='published')
+        self.assertEqual(search_results('migrations', None).paginator.count, 13)
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class TagStatTests(TestCase):
+    '''Счетчики опубликованных статей у тегов поддерживаются сигналами'''
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.post = Post.objects.create(title='First', slug='first', author=self.author,
+                                        body='Text', status='published')
+        self.post.tags.add('django', 'python')
+
+    def counts(self):
+        return dict(TagStat.objects.values_list('tag__name', 'published_count'))
+
+    def test_counts_follow_tags_and_status(self):
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+        draft = Post.objects.create(title='Draft', slug='draft', author=self.author,
+                                    body='Text', status='draft')
+        draft.tags.add('django')
+        self.assertEqual(self.counts()['django'], 1)
+        draft.status = 'published'
+        draft.save()
+        self.assertEqual(self.counts()['django'], 2)
+        self.post.tags.remove('python')
+        self.assertEqual(self.counts()['python'], 0)
+        draft.tags.clear()
+        self.post.delete()
+        self.assertEqual(self.counts(), {'django': 0, 'python': 0})
+        recount_tag_stats()
+        self.assertEqual(self.counts(), {})
+
+    def test_tag_pages_do_not_count_tagged_items(self):
+        self.client.get(reverse('blog:tag_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog:tag_list'))
+            self.client.get(reverse('blog:post_list_by_tag', args=['django']), {'page': 1})
+        self.assertContains(response, 'django')
+        self.assertFalse(any('COUNT' in query['sql'] and 'taggit_taggeditem' in query['sql']
+                             for query in queries))
+
+    def test_cloud_weights(self):
+        other = Post.objects.create(title='Second', slug='second', author=self.author,
+                                    body='Text', status='published')
+        other.tags.add('django')
+        cloud = show_tag_cloud(10)['cloud_tags']
+        self.assertEqual([(tag['name'], tag['weight']) for tag in cloud],
+                         [('django', 5), ('python', 1)])
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0)
+class ArchiveTests(TestCase):
+    '''Архив по годам и месяцам на счетчиках ArchiveMonth'''
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        for day in range(1, 6):
+            Post.objects.create(title='March {}'.format(day), slug='march-{}'.format(day),
+                                author=self.author, body='Text', status='published',
+                                publish=timezone.make_aware(datetime.datetime(2020, 3, day)))
+        self.post = Post.objects.create(title='April', slug='april', author=self.author,
+                                        body='Text', status='published',
+                                        publish=timezone.make_aware(datetime.datetime(2020, 4, 1)))
+
+    def counts(self):
+        return list(ArchiveMonth.objects.filter(published_count__gt=0)
+                    .values_list('year', 'month', 'published_count'))
+
+    def test_counts_follow_status_and_publish(self):
+        self.assertEqual(self.counts(), [(2020, 4, 1), (2020, 3, 5)])
+        self.post.publish = timezone.make_aware(datetime.datetime(2020, 3, 20))
+        self.post.save()
+        self.assertEqual(self.counts(), [(2020, 3, 6)])
+        self.post.status = 'draft'
+        self.post.save()
+        self.assertEqual(self.counts(), [(2020, 3, 5)])
+        Post.objects.get(slug='march-1').delete()
+        self.assertEqual(self.counts(), [(2020, 3, 4)])
+        recount_archive()
+        self.assertEqual(self.counts(), [(2020, 3, 4)])
+
+    def test_year_and_month_pages(self):
+        response = self.client.get(reverse('blog:post_archive_year', args=[2020]))
+        self.assertContains(response, 'March 2020')
+        self.assertEqual(response.context['total'], 6)
+        self.assertEqual(self.client.get(reverse('blog:post_archive_year', args=[2019])).status_code, 404)
+        url = reverse('blog:post_archive_month', args=[2020, 3])
+        posts = self.client.get(url).context['posts']
+        self.assertEqual([post.slug for post in posts], ['march-5', 'march-4', 'march-3'])
+        posts = self.client.get(url, {'cursor': posts.next_cursor}).context['posts']
+        self.assertEqual([post.slug for post in posts], ['march-2', 'march-1'])
+        self.assertEqual(self.client.get(reverse('blog:post_archive_month', args=[2020, 13])).status_code, 404)
+
+
+class ApiTests(TestCase):
+    '''JSON API: выбор полей, курсор, условные запросы и NDJSON'''
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.posts = []
+        for i in range(5):
+            post = Post.objects.create(title='Post {}'.format(i), slug='post-{}'.format(i),
+                                       author=author, body='Body {}'.format(i),
+                                       status='published',
+                                       publish=timezone.now() - datetime.timedelta(days=i))
+            post.tags.add('django')
+            cls.posts.append(post)
+        Comment.objects.create(post=cls.posts[0], name='Reader', email='reader@example.com',
+                               body='Nice')
+
+    def test_list_fields_and_cursor(self):
+        url = reverse('api_v1:post_list')
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {'fields': 'id,title', 'limit': 3}).json()
+        self.assertEqual(data['results'], [{'id': post.id, 'title': post.title}
+                                           for post in self.posts[:3]])
+        self.assertFalse(any('"body"' in query['sql'] for query in queries))
+        data = self.client.get(data['next']).json()
+        self.assertEqual([post['id'] for post in data['results']],
+                         [post.id for post in self.posts[3:]])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+
+    def test_detail_and_conditional_request(self):
+        url = reverse('api_v1:post_detail', args=[self.posts[0].id])
+        response = self.client.get(url)
+        data = response.json()
+        self.assertEqual((data['body'], data['tags'], data['comments_count']),
+                         ('Body 0', ['django'], 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse('api_v1:post_detail', args=[0])).status_code, 404)
+
+    def assertChangedAfter(self, url, change):
+        '''Ответ с прежним ETag не 304 после change()'''
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_new_comment_changes_detail_and_list(self):
+        post = self.posts[1]
+        for url in (reverse('api_v1:post_detail', args=[post.id]), reverse('api_v1:post_list')):
+            data = self.assertChangedAfter(url, lambda: Comment.objects.create(
+                post=post, name='Reader', email='reader@example.com', body='More'))
+            if 'results' in data:
+                data = data['results'][1]
+            self.assertEqual(data['comments_count'], Post.objects.get(id=post.id).comments_count)
+
+    def test_tag_change_changes_detail_and_list(self):
+        post = Post.objects.get(id=self.posts[2].id)
+        for url, tag in ((reverse('api_v1:post_detail', args=[post.id]), 'python'),
+                         (reverse('api_v1:post_list'), 'web')):
+            data = self.assertChangedAfter(url, lambda: post.tags.add(tag))
+            if 'results' in data:
+                data = data['results'][2]
+            self.assertIn(tag, data['tags'])
+
+    def test_comments_and_tags(self):
+        data = self.client.get(reverse('api_v1:post_comments', args=[self.posts[0].id])).json()
+        self.assertEqual([comment['body'] for comment in data['results']], ['Nice'])
+        self.assertNotIn('email', data['results'][0])
+        data = self.client.get(reverse('api_v1:tag_list')).json()
+        self.assertEqual(data['results'], [{'name': 'django', 'slug': 'django', 'count': 5}])
+
+    def test_ndjson_stream(self):
+        response = self.client.get(reverse('api_v1:post_stream'), {'fields': 'id,tags'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [{'id': post.id, 'tags': ['django']}
+                                for post in sorted(self.posts, key=lambda post: post.id)])
+
+    def test_ndjson_stream_refused_under_asgi(self):
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                 'method': 'GET', 'scheme': 'http', 'path': reverse('api_v1:post_stream'),
+                 'query_string': b'fields=id,tags', 'root_path': '',
+                 'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0),
+                 'server': ('testserver', 80)}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        # Как и тестовый клиент, не закрываем соединение с БД тестовой транзакции
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(get_asgi_application())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        # Django 3.1 читает потоковый ответ в цикле событий, где ORM запрещен
+        self.assertEqual(messages[0]['status'], 406)
+        self.assertIn(b'export_posts', messages[1]['body'])
+
+
+class AdminTests(TestCase):
+    '''Списки админки без COUNT(*) и модерация комментариев'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.post = Post.objects.create(title='Django migrations', slug='django-migrations',
+                                       author=cls.admin, body='Indexes and vacuum',
+                                       status='published')
+        for i in range(3):
+            Comment.objects.create(post=cls.post, name='Reader {}'.format(i),
+                                   email='reader@example.com', body='Text', active=False)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_estimated_count_for_large_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE blog_comment')
+        with mock.patch('blog.pagination.ESTIMATE_THRESHOLD', 1):
+            paginator = EstimatedCountPaginator(Comment.objects.all(), 10)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(paginator.count, 3)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            response = self.client.get(reverse('admin:blog_comment_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_search_uses_search_vector(self):
+        url = reverse('admin:blog_post_changelist')
+        response = self.client.get(url, {'q': 'vacuum'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.post])
+        response = self.client.get(url, {'month': '{}-{}'.format(
+            self.post.publish.year, self.post.publish.month)})
+        self.assertEqual(list(response.context['cl'].result_list), [self.post])
+
+    def test_invalid_month_filter_is_empty(self):
+        url = reverse('admin:blog_post_changelist')
+        for month in ('2020-13', '0-1', 'june'):
+            response = self.client.get(url, {'month': month})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_bulk_approve_updates_counter(self):
+        ids = list(Comment.objects.values_list('id', flat=True))
+        response = self.client.post(reverse('admin:blog_comment_changelist'),
+                                    {'action': 'approve_comments', '_selected_action': ids})
+        self.assertEqual(response.status_code, 302)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 3)
+        self.assertEqual(Comment.objects.filter(active=True).count(), 3)
+
+
+class CompressionTests(TestCase):
+    '''Сжатие HTML и потоковых ответов'''
+
+    def test_pages_and_streams_are_gzipped(self):
+        author = User.objects.create_user('author')
+        for i in range(5):
+            Post.objects.create(title='Post {}'.format(i), slug='post-{}'.format(i),
+                                author=author, body='Text ' * 50, status='published')
+        response = self.client.get(reverse('blog:post_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get(reverse('api_v1:post_stream'), {'fields': 'id,body'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 5)
+        # Страница статьи с формой комментария (CSRF токен) не сжимается
+        response = self.client.get(Post.objects.first().get_absolute_url(),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(BLOG_PAGE_CACHE_TIMEOUT=0, BLOG_INSTRUMENTATION=False)
+class BenchmarkTests(TransactionTestCase):
+    '''
+    Команды нагрузочных прогонов на крошечном наборе данных. Запросы
+    идут из других потоков, поэтому данные фиксируются в БД.
+    '''
+
+    def seed(self, *args):
+        call_command('seed_blog', '--posts', '12', '--tags', '4', '--users', '2',
+                     '--comments', '1', '--words', '20', '--batch-size', '5', *args,
+                     stdout=io.StringIO())
+
+    def test_summary(self):
+        self.assertEqual(bench.percentile([3, 1, 2, 4], 0.5), 2)
+        self.assertIsNone(bench.percentile([], 0.5))
+        self.assertEqual(bench.query_count([('Server-Timing', 'db;desc="7 queries"')]), 7)
+        stats = bench.summarize([0.001, 0.003], 0.5, [7, None], [200, 200])
+        self.assertEqual((stats['rps'], stats['p99_ms'], stats['queries_mean']), (4.0, 3.0, 7))
+        self.assertEqual(stats['statuses'], {'200': 2})
+
+    def test_seed_keeps_unrelated_cache(self):
+        blog_cache().set('unrelated', 1)
+        total_post()
+        self.seed('--drafts', '0')
+        # Счетчик боковой панели сброшен версией, а не очисткой кэша
+        self.assertEqual(total_post(), 12)
+        self.assertEqual(blog_cache().get('unrelated'), 1)
+        self.seed('--posts', '0', '--clear')
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(total_post(), 0)
+
+    def test_seed_then_bench_blog(self):
+        self.seed()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'report.json')
+        # ALLOWED_HOSTS в тестах - только testserver
+        call_command('bench_blog', '--requests', '1', '--concurrency', '1', '--sample', '1',
+                     '--host', 'testserver', '--output', output, stdout=io.StringIO())
+        with open(output) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['meta']['dataset']['posts'], 12)
+        self.assertIn('post_detail', report['endpoints'])
+        for name, stats in report['endpoints'].items():
+            self.assertEqual(stats['statuses'], {'200': 1}, name)
+            self.assertIsNotNone(stats['queries_mean'], name)
+
+    def test_bench_asgi_and_connections(self):
+        self.seed()
+        out = io.StringIO()
+        call_command('bench_asgi', '--server', 'asgi', '--requests', '1', '--concurrency', '1',
+                     '--host', 'testserver', '--path', '/blog/', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['paths']['/blog/']['statuses'], {'200': 1})
+        out = io.StringIO()
+        call_command('bench_connections', '--requests', '2', '--concurrency', '1', stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()],
+                         ['connect', 'pool'])
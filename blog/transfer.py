@@ -0,0 +1,219 @@
+'''
+Выгрузка и загрузка статей с тегами и комментариями.
+Форматы: JSON Lines (одна статья на строку, без потерь) и CSV (теги
+и комментарии - JSON в своих колонках, запятая в имени тега не мешает). Статьи читаются и
+пишутся пачками, поэтому память не зависит от размера архива.
+'''
+import csv
+import itertools
+import json
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+from .models import Post, Comment, post_search_vector
+
+FORMATS = ('jsonl', 'csv')
+CSV_FIELDS = ('title', 'slug', 'author', 'body', 'publish', 'created', 'updated',
+              'status', 'tags', 'comments')
+POST_FIELDS = ('id', 'title', 'slug', 'author__username', 'body', 'publish',
+               'created', 'updated', 'status')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_for(path, default='jsonl'):
+    '''Формат по расширению файла'''
+    return 'csv' if path.endswith('.csv') else default
+
+
+def export_records(queryset=None, chunk_size=1000):
+    '''
+    Словари статей для выгрузки. Пачки выбираются по id, теги и
+    комментарии пачки - двумя запросами.
+    '''
+    if queryset is None:
+        queryset = Post.objects.all()
+    content_type = ContentType.objects.get_for_model(Post)
+    last_id = 0
+    while True:
+        posts = list(queryset.filter(id__gt=last_id).order_by('id')
+                     .values(*POST_FIELDS)[:chunk_size])
+        if not posts:
+            break
+        ids = [post['id'] for post in posts]
+        tags = defaultdict(list)
+        for object_id, name in TaggedItem.objects\
+                .filter(content_type=content_type, object_id__in=ids)\
+                .order_by('object_id', 'tag__name').values_list('object_id', 'tag__name'):
+            tags[object_id].append(name)
+        comments = defaultdict(list)
+        for comment in Comment.objects.filter(post_id__in=ids).order_by('post_id', 'id')\
+                .values('post_id', 'name', 'email', 'body', 'created', 'active'):
+            post_id = comment.pop('post_id')
+            comment['created'] = comment['created'].isoformat()
+            comments[post_id].append(comment)
+        for post in posts:
+            post_id = post.pop('id')
+            post['author'] = post.pop('author__username')
+            for field in ('publish', 'created', 'updated'):
+                post[field] = post[field].isoformat()
+            post['tags'] = tags[post_id]
+            post['comments'] = comments[post_id]
+            yield post
+        last_id = ids[-1]
+
+
+def write_records(records, stream, format='jsonl'):
+    '''Пишет записи в поток, возвращает их количество'''
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, CSV_FIELDS)
+        writer.writeheader()
+    for record in records:
+        if format == 'csv':
+            writer.writerow(dict(record, tags=json.dumps(record['tags'], ensure_ascii=False),
+                                 comments=json.dumps(record['comments'], ensure_ascii=False)))
+        else:
+            stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def read_records(stream, format='jsonl'):
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            row['tags'] = json.loads(row.get('tags') or '[]')
+            row['comments'] = json.loads(row.get('comments') or '[]')
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_date(value, default=None):
+    if not value:
+        return default
+    date = parse_datetime(value)
+    if date is None:
+        raise ValueError('Invalid date: {!r}'.format(value))
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def resolve_users(usernames, users):
+    '''
+    id авторов по именам, users - кэш между пачками. Отсутствующие
+    пользователи создаются без пароля (войти под ними нельзя).
+    '''
+    missing = set(usernames) - set(users)
+    if missing:
+        users.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        missing -= set(users)
+        created = User.objects.bulk_create(
+            [User(username=name, password=make_password(None)) for name in missing])
+        users.update((user.username, user.id) for user in created)
+    return users
+
+
+def resolve_tags(names):
+    '''id тегов по именам; новые теги создаются одним запросом'''
+    tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = sorted(set(names) - set(tags))
+    if not missing:
+        return tags
+    slugs = {name: Tag().slugify(name) for name in missing}
+    taken = set(Tag.objects.filter(slug__in=slugs.values()).values_list('slug', flat=True))
+    new = []
+    for name in missing:
+        if not slugs[name] or slugs[name] in taken:
+            # Конфликт slug: taggit сам подберет свободный с суффиксом
+            tag = Tag(name=name)
+            tag.save()
+            tags[name] = tag.id
+        else:
+            taken.add(slugs[name])
+            new.append(Tag(name=name, slug=slugs[name]))
+    tags.update((tag.name, tag.id) for tag in Tag.objects.bulk_create(new))
+    return tags
+
+
+def import_chunk(records, users, content_type):
+    '''
+    Загружает пачку записей, возвращает (id новых статей, пропущено,
+    [(slug, статус)] записей с неизвестным статусом). Такие записи и
+    статьи, у которых уже есть статья с тем же slug в тот же день,
+    пропускаются, поэтому загрузку можно повторить. Сигналы не
+    вызываются: HTML, анонс, счетчик комментариев и вектор поиска
+    заполняются здесь же.
+    '''
+    now = timezone.now()
+    existing = {(slug, timezone.localdate(publish)) for slug, publish in
+                Post.objects.filter(slug__in={record['slug'] for record in records})
+                .values_list('slug', 'publish')}
+    statuses = {choice for choice, _ in Post.STATUS_CHOICES}
+    rows = []
+    invalid = []
+    for record in records:
+        if (record.get('status') or 'draft') not in statuses:
+            invalid.append((record['slug'], record['status']))
+            continue
+        publish = parse_date(record.get('publish'), now)
+        key = (record['slug'], timezone.localdate(publish))
+        if key in existing:
+            continue
+        existing.add(key)
+        rows.append((record, publish))
+    if not rows:
+        return [], len(records), invalid
+    resolve_users({record['author'] for record, _ in rows}, users)
+    posts = []
+    for record, publish in rows:
+        comments = record.get('comments') or ()
+        post = Post(title=record['title'], slug=record['slug'],
+                    author_id=users[record['author']], body=record['body'],
+                    publish=publish, status=record.get('status') or 'draft',
+                    comments_count=sum(1 for comment in comments
+                                       if comment.get('active', True)))
+        post.render_body()
+        posts.append(post)
+    Post.objects.bulk_create(posts)
+    # auto_now/auto_now_add перезаписали даты при вставке, восстанавливаем
+    for post, (record, publish) in zip(posts, rows):
+        post.created = parse_date(record.get('created'), post.created)
+        post.updated = parse_date(record.get('updated'), post.updated)
+    Post.objects.bulk_update(posts, ['created', 'updated'])
+    ids = [post.id for post in posts]
+    Post.objects.filter(id__in=ids).update(search_vector=post_search_vector())
+
+    tags = resolve_tags({name for record, _ in rows for name in record.get('tags') or ()})
+    TaggedItem.objects.bulk_create(
+        [TaggedItem(tag_id=tags[name], content_type=content_type, object_id=post.id)
+         for post, (record, _) in zip(posts, rows) for name in set(record.get('tags') or ())])
+
+    comments = []
+    dates = []
+    for post, (record, _) in zip(posts, rows):
+        for data in record.get('comments') or ():
+            comments.append(Comment(post_id=post.id, name=data['name'],
+                                    email=data['email'], body=data['body'],
+                                    active=data.get('active', True)))
+            dates.append(parse_date(data.get('created'), post.publish))
+    Comment.objects.bulk_create(comments)
+    for comment, created in zip(comments, dates):
+        comment.created = comment.updated = created
+    Comment.objects.bulk_update(comments, ['created', 'updated'])
+    return ids, len(records) - len(rows), invalid
@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-from .feeds import LatestPostsFeed
+from . import views, async_views
+from .feeds import latest_posts_feed
 app_name = 'blog' # определии пространство имен приложения
 
 ''' 
@@ -8,13 +9,26 @@ app_name = 'blog' # определии пространство имен при
 
 '''
 
+# Под ASGI (BLOG_ASYNC_VIEWS) страницы чтения обслуживают асинхронные
+# обработчики, под WSGI - обычные синхронные
+if settings.BLOG_ASYNC_VIEWS:
+    read_views = async_views
+    post_feed = async_views.post_feed
+else:
+    read_views = views
+    post_feed = latest_posts_feed
+
 urlpatterns = [
-    path('', views.post_list, name='post_list'),
+    path('', read_views.post_list, name='post_list'),
     # path('', views.PostListView.as_view(), name = 'post_list'),
     path('<int:year>/<int:month>/<int:day>/<slug:post>/',
-         views.post_detail, name='post_detail'),
+         read_views.post_detail, name='post_detail'),
     path('<int:post_id>/share/', views.post_share, name = 'post_share'),
-    path('tag/<slug:tag_slug>/', views.post_list, name= 'post_list_by_tag'),
-    path('feed/', LatestPostsFeed(), name='post_feed'),
-    path('search/', views.post_search, name='post_search'),
+    path('tag/<slug:tag_slug>/', read_views.post_list, name= 'post_list_by_tag'),
+    path('tags/', views.tag_list, name='tag_list'),
+    path('<int:year>/', views.post_archive_year, name='post_archive_year'),
+    path('<int:year>/<int:month>/', views.post_archive_month, name='post_archive_month'),
+    path('feed/', post_feed, name='post_feed'),
+    path('search/', read_views.post_search, name='post_search'),
+    path('search/suggest/', views.post_suggest, name='post_suggest'),
 ]
\ No newline at end of file
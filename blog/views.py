@@ -1,38 +1,78 @@
+import hashlib
+
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404
+from django.urls import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .models import Post, Comment
+from .models import ArchiveMonth, Post, Comment, TagStat
+from .pagination import CursorPaginator
+from .sitemaps import month_range
+from .conditions import post_detail_etag, post_detail_last_modified
+from django.views.decorators.http import condition
 from django.views.generic import ListView
 from .forms import EmailPostForm, CommentForm, SearchForm
-from django.core.mail import send_mail
+from .mail import enqueue_mail
 from taggit.models import Tag
-from django.db.models import Count
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from .cache import get_or_set
+
+
+# Количество статей на одной странице списка
+POSTS_PER_PAGE = 3
+# Подсказки поиска: минимальная длина запроса и максимум результатов
+SUGGEST_MIN_LENGTH = 2
+SUGGEST_LIMIT = 10
+# Сколько найденных статей запоминается для одного поискового запроса
+SEARCH_RESULTS_LIMIT = 500
+# Количество тегов на одной странице списка тегов
+TAGS_PER_PAGE = 100
+
+
+def published_posts():
+    '''
+    Опубликованные статьи вместе с авторами (JOIN) и тегами (один
+    дополнительный запрос на страницу), чтобы шаблон списка не делал
+    отдельных запросов для каждой статьи.
+    '''
+    return Post.published.select_related('author').prefetch_related('tags')
 
 
 class PostListView(ListView):
-    queryset = Post.published.all()
+    queryset = published_posts()
     context_object_name = 'posts'
-    paginate_by = 3
+    paginate_by = POSTS_PER_PAGE
     template_name = 'blog/post/list.html'
 
 
-def post_list(request, tag_slug=None):
+def post_list_context(request, tag_slug=None):
     '''
-    Обработчик отображения списка статей.
-     Получает объекты request в качестве обязательного аргумента.
-    Запрашиваем из БД все опубликованные статьи  спомощью нашего
-    менеджера published.
-    render - формирует шаблон со списком статей. В ответ возвращается
-    объект HttpResponse c HTML кодом. Render передает переданную ей
-    переменные в контекст шаблона. Поэтому все переменные работают в шаблоне.
+    Контекст страницы списка: тег и текущая страница статей.
+    Статьи страницы загружаются сразу, чтобы асинхронная версия
+    обработчика могла выполнить запросы вне потока рендеринга.
     '''
-    object_list = Post.published.all().filter(status='published')
+    object_list = published_posts()
     tag = None
     if tag_slug:
-        tag = get_object_or_404(Tag, slug = tag_slug)
-        print(tag)
+        # Количество статей тега берется из TagStat, а не подсчетом связей
+        tag = get_object_or_404(Tag.objects.annotate(
+            published_count=Coalesce('blog_stat__published_count', 0)), slug = tag_slug)
         object_list = object_list.filter(tags__in=[tag])
-    paginator = Paginator(object_list, 3) # По три статьи на странице
+    if 'page' not in request.GET:
+        # По умолчанию курсорная пагинация по (publish, id):
+        # без OFFSET и без COUNT(*) по всей выборке
+        paginator = CursorPaginator(object_list, POSTS_PER_PAGE)
+        posts = paginator.page(request.GET.get('cursor'))
+        return {'posts': posts,
+                'tag': tag}
+    # Старые ссылки вида ?page=N продолжают работать через Paginator
+    paginator = Paginator(object_list, POSTS_PER_PAGE)
+    if tag is not None:
+        paginator.count = tag.published_count
     page = request.GET.get('page')
 
     try:
@@ -45,13 +85,37 @@ def post_list(request, tag_slug=None):
         # Если страница не является больше, чем общее количество страниц,
         # возвращаем последнюю
         posts = paginator.page(paginator.num_pages)
-    # posts = Post.published.all()
+    posts.object_list = list(posts.object_list)
+    return {'page': page,
+            'posts': posts,
+            'tag': tag}
+
+
+def post_list(request, tag_slug=None):
+    '''
+    Обработчик отображения списка статей.
+     Получает объекты request в качестве обязательного аргумента.
+    Запрашиваем из БД все опубликованные статьи  спомощью нашего
+    менеджера published.
+    render - формирует шаблон со списком статей. В ответ возвращается
+    объект HttpResponse c HTML кодом. Render передает переданную ей
+    переменные в контекст шаблона. Поэтому все переменные работают в шаблоне.
+    '''
     return render(request,
                   'blog/post/list.html',
-                  {'page': page,
-                   'posts': posts,
-                   'tag': tag})
+                  post_list_context(request, tag_slug))
+
+
+def similar_posts_for(post):
+    '''
+    Список похожих статей заранее посчитан (см. blog/similar.py),
+    здесь только чтение по индексу (post, rank)
+    '''
+    return Post.published.filter(similar_to__post=post)\
+        .order_by('similar_to__rank')
 
+@condition(etag_func=post_detail_etag,
+           last_modified_func=post_detail_last_modified)
 def post_detail(request, year, month, day, post):
     '''
     Обработчик страницы статьи.
@@ -63,11 +127,7 @@ def post_detail(request, year, month, day, post):
     объект подходящий по параметрам или вызывает 404.
     '''
 
-    post = get_object_or_404(Post, slug=post,
-                             status='published',
-                             publish__year=year,
-                             publish__month=month,
-                             publish__day=day,)
+    post = get_object_or_404(Post.published.by_date(year, month, day, post))
     # Список активных комментариев для этой статьи
     # comments is <QuerySet[]>
     comments = post.comments.filter(active=True)
@@ -83,15 +143,12 @@ def post_detail(request, year, month, day, post):
             new_comment.post = post
             # Сохр комментрий в БД
             new_comment.save()
+            # Счетчик увеличен в БД сигналом, перечитываем его
+            post.refresh_from_db(fields=['comments_count'])
         else:
             comment_form = CommentForm()
 
-    # формирование списка похожих статей
-    post_list_ids = post.tags.values_list('id', flat=True)
-    similar_posts = Post.published.filter(tags__in=post_list_ids)\
-                        .exclude(id=post.id)
-    similar_posts = similar_posts.annotate(same_tags=Count('tags'))\
-                        .order_by('-same_tags', '-publish')[:4]
+    similar_posts = similar_posts_for(post)
 
     return  render(request, 'blog/post/detail.html', {'post': post,
                                                       'comments': comments,
@@ -115,81 +172,153 @@ def post_share(request, post_id):
     # для обработки введенных данных
     # Заполненная форма отправляется POST запросом
     # Пустая форма отображается методом GET
-    print(request.method)
     if request.method == 'POST':
-        #print('*' * 70+'\n'+'try - except | ' * 3 +'\n'+ '*'* 70+'\nif 1: POST')
-        # request.method - это POST or GET
         # Если пользователь заполнил форму и отправляет POST-запросом.
         # Создаем объект формы, использую полученные из request.POST данные
-        # форма была отправлена на сохранение
         # request.POST - это <QueryDict:{['':'']}>
         form = EmailPostForm(request.POST)
-        print('#' * 70)
-        print(form.is_valid())
-        print('#' * 70)
         if form.is_valid():
-            try:
-                #print('if 2: is_valid() = True')
             # Выполняем проверку введенных данных с пом is_valid()
-            # from.is_valid() - это True (без ошибок) или False (есть ошибки)
             # Список полей с ошибками смотрим в form.errors
             # все поля формы прошли валидацию, получаем введенные данные
             # с помощью form.cleaned_data.
-            # Если форма не проходит валидащцию, то в cleaned_data попадут только
-            # корректные поля
             # from.cleaned_data - это словарь с     {'name':'Name',
             #                  данными из формы      'email': 'Email',
             #                                        'to':' Email',
             #                                        'comments':'Text'}
-                cd = form.cleaned_data
-            # Отправка электронной почты
-            # post.get_abcolute_url() - ecть /blog/2020/3/22/auther-post/
+            cd = form.cleaned_data
             # request.build_absolute_url(post.get_absolute_url()) -   есть
             # url статьи которой делятся
             # (http://localhost:8000/blog/2020/3/22/auther-post/)
-                post_url = request.build_absolute_uri(post.get_absolute_url())
-            # cоздаем ссылку на статью
-                subject = '{} ({}) recommends you reading "{}"'.format(cd['name'],
-                                                               cd['email'],
-                                                               post.title)
-            # Обращение к читателю в title
-            # subject есть (Ваня (...@mail.ru) recommends you reading "Статья")
-
-                message = 'Read "{}" at {}\n\n{}\'s comments: {}'.format(post.title,
-                                                                 post_url,
-                                                                 cd['name'],
-                                                                 cd['comments'])
-
-                send_mail(subject, message, 'admin@blog.com', [cd['to']])
-                sent = True
-            except ConnectionRefusedError:
-                 print('except ConnectionRefusedError: is_valid() = True')
-                # print('Message go to {}'.format(cd['email']))
-                 sent = True
-                 return render(request,
-                             'blog/post/share.html',
-                              {'post': post, 'form': form,
-                                'sent': sent})
-        else:
-            # когда обработчик выполняется первый раз с GET-запросом, создаем
-            # объект form, который будет отображен в шаблоне как пустая форма
-            form = EmailPostForm()
-            # print('else 1: is_valid = False')
-            return render(request,
-                          'blog/post/share.html',
-                          {'post': post, 'form': form,
-                           'sent': sent})
-            # Если форма с ошибками, возвращаем ее с введенными пользователем
-            # данными в html шаблон
+            post_url = request.build_absolute_uri(post.get_absolute_url())
+            subject = '{} ({}) recommends you reading "{}"'.format(cd['name'],
+                                                                   cd['email'],
+                                                                   post.title)
+            message = 'Read "{}" at {}\n\n{}\'s comments: {}'.format(post.title,
+                                                                     post_url,
+                                                                     cd['name'],
+                                                                     cd['comments'])
+            # Письмо только ставится в очередь, отправляет его
+            # команда send_queued_mail, запрос не ждет SMTP сервер
+            enqueue_mail(subject, message, 'admin@blog.com', cd['to'])
+            sent = True
+        # Если форма с ошибками, возвращаем ее с введенными пользователем
+        # данными в html шаблон
     else:
+        # когда обработчик выполняется первый раз с GET-запросом, создаем
+        # объект form, который будет отображен в шаблоне как пустая форма
         form = EmailPostForm()
-        return render(request,
-                      'blog/post/share.html',
-                      {'post' : post,
-                       'form': form,
-                       'sent': sent})
+    return render(request,
+                  'blog/post/share.html',
+                  {'post': post,
+                   'form': form,
+                   'sent': sent})
+
+def normalize_query(query):
+    '''
+    Запрос в виде tsquery, как его понимает PostgreSQL: регистр, пробелы,
+    стоп-слова и словоформы (stemming) на результат не влияют.
+    '''
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute('SELECT plainto_tsquery(%s)::text', [query])
+        return cursor.fetchone()[0]
+
+
+def ranked_post_ids(query):
+    '''
+    id найденных статей по убыванию ранга (не больше SEARCH_RESULTS_LIMIT)
+    и признак нечеткого поиска. Если по рангу ничего не нашлось (например,
+    запрос с опечаткой), ищем статьи с похожим заголовком.
+    '''
+    ids = matching_post_ids(query)
+    if ids:
+        return False, ids
+    return True, similar_title_ids(query)
+
+
+def matching_post_ids(query):
+    '''Полнотекстовый поиск по сохраненному полю search_vector (GIN индекс)'''
+    search_query = SearchQuery(query)
+    return list(Post.published.annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    ).filter(search_vector=search_query,
+             rank__gte=0.3).order_by('-rank', '-publish')
+        .values_list('id', flat=True)[:SEARCH_RESULTS_LIMIT])
+
+
+def similar_title_ids(query):
+    '''Статьи с похожим заголовком по триграммам'''
+    return list(Post.published.filter(title__trigram_similar=query).annotate(
+        similarity=TrigramSimilarity('title', query)
+    ).order_by('-similarity', '-publish').values_list('id', flat=True)[:SEARCH_RESULTS_LIMIT])
+
+
+def post_archive_year(request, year):
+    '''Месяцы года с количеством статей, без группировки таблицы статей'''
+    months = list(ArchiveMonth.objects.filter(year=year, published_count__gt=0)
+                  .order_by('month'))
+    if not months:
+        raise Http404('No posts in {}'.format(year))
+    return render(request, 'blog/post/archive_year.html',
+                  {'year': year, 'months': months,
+                   'total': sum(month.published_count for month in months)})
+
+
+def post_archive_month(request, year, month):
+    '''
+    Статьи месяца: диапазон publish и курсорная пагинация по индексу
+    опубликованных статей. Количество статей - из ArchiveMonth.
+    '''
+    archive_month = get_object_or_404(ArchiveMonth, year=year, month=month,
+                                      published_count__gt=0)
+    start, end = month_range(year, month)
+    object_list = published_posts().filter(publish__gte=start, publish__lt=end)
+    posts = CursorPaginator(object_list, POSTS_PER_PAGE).page(request.GET.get('cursor'))
+    return render(request, 'blog/post/list.html', {'posts': posts,
+                                                   'archive_month': archive_month})
+
+
+def tag_list(request):
+    '''Все теги с опубликованными статьями, количество из TagStat'''
+    stats = TagStat.objects.filter(published_count__gt=0).select_related('tag')\
+        .order_by('tag__name')
+    tags = Paginator(stats, TAGS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'blog/post/tag_list.html', {'tags': tags})
+
+
+def search_cache_key(prefix, text):
+    return '{}:{}'.format(prefix, hashlib.md5(text.encode()).hexdigest())
+
+
+def search_results(query, page):
+    '''
+    Страница результатов полнотекстового поиска.
+    Список id кэшируется по нормализованному запросу (нечеткий поиск - по
+    тексту запроса) в пространстве 'posts', которое сбрасывается при
+    изменении любой статьи. Общее количество берется из длины списка,
+    статьи страницы загружаются одним запросом.
+    results.fuzzy - результаты нечеткого поиска.
+    '''
+    text = ' '.join(query.lower().split())
+    timeout = getattr(settings, 'BLOG_SEARCH_CACHE_TIMEOUT', 10 * 60)
+    key = normalize_query(query) or text
+    fuzzy, ids = False, get_or_set('posts', search_cache_key('search', key),
+                                   lambda: matching_post_ids(query), timeout)
+    if not ids:
+        # Триграммы зависят от самого текста, а не от tsquery: разные
+        # запросы с одинаковым tsquery находят разные заголовки
+        fuzzy, ids = True, get_or_set('posts', search_cache_key('similar', text),
+                                      lambda: similar_title_ids(text), timeout)
+    results = Paginator(ids, 10).get_page(page)
+    posts = Post.published.in_bulk(results.object_list)
+    results.object_list = [posts[post_id] for post_id in results.object_list
+                           if post_id in posts]
+    results.fuzzy = fuzzy
+    return results
+
 
 def post_search(request):
+    '''Полнотекстовый поиск по опубликованным статьям'''
     form = SearchForm()
     query = None
     results = []
@@ -197,16 +326,48 @@ def post_search(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            search_vector = SearchVector('title', weight='A') + SearchVector('body', weight='B')
-            search_query = SearchQuery(query)
-            results = Post.objects.annotate(
-                search=search_vector,
-                rank=SearchRank(search_vector,search_query)
-            ).filter(rank__gte=0.3).order_by('-rank')
+            results = search_results(query, request.GET.get('page'))
     return render(request, 'blog/post/search.html', {'form': form,
                                                          'query': query,
                                                          'results': results})
 
 
+def suggestions(query, limit):
+    '''
+    Заголовки статей и теги, содержащие запрос или похожие на него.
+    Оба условия (ILIKE и оператор %) обслуживает триграммный GIN индекс.
+    Теги только с опубликованными статьями (по TagStat): теги черновиков
+    не видны посетителям.
+    '''
+    posts = Post.published.filter(Q(title__icontains=query) | Q(title__trigram_similar=query))\
+        .annotate(similarity=TrigramSimilarity('title', query))\
+        .order_by('-similarity', '-publish').only('title', 'slug', 'publish')[:limit]
+    tags = Tag.objects.filter(Q(name__icontains=query) | Q(name__trigram_similar=query),
+                              blog_stat__published_count__gt=0)\
+        .annotate(similarity=TrigramSimilarity('name', query))\
+        .order_by('-similarity', 'name').only('name', 'slug')[:limit]
+    return {'posts': [{'title': post.title, 'url': post.get_absolute_url()} for post in posts],
+            'tags': [{'name': tag.name,
+                      'url': reverse('blog:post_list_by_tag', args=[tag.slug])} for tag in tags]}
+
+
+def post_suggest(request):
+    '''
+    Подсказки для поиска по мере ввода (JSON): ?q=запрос&limit=N.
+    Результаты частых запросов кэшируются на BLOG_SUGGEST_CACHE_TIMEOUT секунд.
+    '''
+    query = ' '.join(request.GET.get('q', '').lower().split())[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_LIMIT)), 1), SUGGEST_LIMIT)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    data = {'posts': [], 'tags': []}
+    if len(query) >= SUGGEST_MIN_LENGTH:
+        key = hashlib.md5(query.encode()).hexdigest()
+        data = get_or_set('suggest', '{}:{}'.format(limit, key),
+                          lambda: suggestions(query, limit),
+                          getattr(settings, 'BLOG_SUGGEST_CACHE_TIMEOUT', 60))
+    return JsonResponse(dict(data, query=query))
+
 
 # Create your views here.
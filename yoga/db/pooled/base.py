@@ -0,0 +1,51 @@
+'''
+PostgreSQL бэкенд с пулом соединений.
+Вместо нового соединения на каждый запрос Django берет готовое из пула
+процесса и возвращает его в пул в конце запроса (CONN_MAX_AGE = 0).
+Настройки пула в DATABASES[...]['OPTIONS']['pool']: min_size, max_size,
+timeout, check_interval (см. pool.ConnectionPool).
+'''
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as BaseCreation
+from django.utils.asyncio import async_unsafe
+
+from .pool import close_pools, get_pool
+
+
+class DatabaseCreation(BaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Соединения из пула держат тестовую БД открытой
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_pool(self, conn_params):
+        return get_pool(conn_params, self.settings_dict['OPTIONS'].get('pool', {}))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).checkout()
+        # Как в базовом бэкенде: уровень изоляции из OPTIONS или по умолчанию
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool(self.get_connection_params()).checkin(self.connection)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+from psycopg2 import OperationalError, extensions, pool as psycopg2_pool
+
+# Пулы процесса: ключ - (pid, параметры соединения). После fork у
+# процесса-потомка будет свой пул, сокеты родителя не используются.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    '''
+    Потокобезопасный пул соединений psycopg2.
+    max_size - сколько соединений может быть выдано одновременно, если
+    все заняты, checkout() ждет до timeout секунд.
+    Соединение, которое не использовалось дольше check_interval секунд,
+    перед выдачей проверяется запросом SELECT 1.
+    '''
+
+    def __init__(self, conn_params, min_size=1, max_size=10, timeout=10,
+                 check_interval=30):
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._pool = psycopg2_pool.ThreadedConnectionPool(min_size, max_size,
+                                                          **conn_params)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+
+    def checkout(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError('Connection pool exhausted, waited %ss' % self.timeout)
+        try:
+            # Свободных соединений в пуле не больше max_size, после них
+            # getconn() открывает новое: если и оно не отвечает, БД недоступна
+            for _ in range(self.max_size + 1):
+                connection = self._pool.getconn()
+                if self._healthy(connection):
+                    return connection
+                self._discard(connection)
+            raise OperationalError('No healthy connection in the pool')
+        except Exception:
+            self._slots.release()
+            raise
+
+    def checkin(self, connection):
+        '''Возвращает соединение в пул, незавершенная транзакция откатывается'''
+        try:
+            close = connection.closed
+            if not close:
+                status = connection.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            self._last_used[id(connection)] = time.monotonic()
+            self._pool.putconn(connection, close=close)
+        finally:
+            self._slots.release()
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except OperationalError:
+            return False
+        return True
+
+    def _discard(self, connection):
+        self._last_used.pop(id(connection), None)
+        self._pool.putconn(connection, close=True)
+
+    def close(self):
+        self._pool.closeall()
+
+
+def get_pool(conn_params, options):
+    key = (os.getpid(), tuple(sorted(conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(conn_params, **options)
+        return pool
+
+
+def close_pools(database=None):
+    '''Закрывает пулы процесса (все или только для БД database)'''
+    with _pools_lock:
+        for key, pool in list(_pools.items()):
+            if database is None or dict(key[1]).get('database') == database:
+                pool.close()
+                del _pools[key]
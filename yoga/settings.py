@@ -46,11 +46,24 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Статические файлы: сжатые варианты и долгий кэш для файлов с хэшем
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Сжатие HTML, RSS, карты сайта и JSON (в том числе потоковых ответов),
+    # кроме страниц с CSRF токеном (BREACH). Стоит до ConditionalGetMiddleware,
+    # чтобы ETag считался по несжатому телу
+    'blog.middleware.CsrfSafeGZipMiddleware',
+    # Учет SQL и шаблонов, заголовок Server-Timing (BLOG_INSTRUMENTATION)
+    'blog.middleware.RequestTimingMiddleware',
+    # 304 по ETag/Last-Modified и для ответов из кэша страниц
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Чтение с реплик в GET запросах, закрепление сессии после записи
+    'blog.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'blog.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -58,7 +71,8 @@ ROOT_URLCONF = 'yoga.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который учитывает время рендеринга в Server-Timing
+        'BACKEND': 'blog.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,6 +88,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yoga.wsgi.application'
 
+# Асинхронные обработчики чтения (blog/async_views.py). Включается в
+# yoga/asgi.py, под WSGI остаются синхронные обработчики
+BLOG_ASYNC_VIEWS = os.environ.get('BLOG_ASYNC_VIEWS') == '1'
+# Потоки асинхронных обработчиков для параллельных запросов к БД,
+# у каждого постоянное соединение (учитывайте в BLOG_DB_POOL_MAX)
+BLOG_ASYNC_DB_THREADS = int(os.environ.get('BLOG_ASYNC_DB_THREADS', 4))
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -84,10 +105,90 @@ DATABASES = {
         'NAME': 'blog',
         'USER': 'blog',
         'PASSWORD': 'blog',
+        # Сколько секунд держать соединение открытым между запросами
+        # (0 - закрывать после каждого запроса)
+        'CONN_MAX_AGE': int(os.environ.get('BLOG_DB_CONN_MAX_AGE', 0)),
+    }
+}
+
+# Пул соединений (BLOG_DB_POOL=1): соединения берутся из пула процесса
+# вместо подключения к PostgreSQL на каждый запрос. Размер пула на процесс,
+# при нескольких воркерах следите за max_connections в PostgreSQL.
+if os.environ.get('BLOG_DB_POOL') == '1':
+    DATABASES['default']['ENGINE'] = 'yoga.db.pooled'
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('BLOG_DB_POOL_MIN', 1)),
+            'max_size': int(os.environ.get('BLOG_DB_POOL_MAX', 10)),
+            'timeout': 10,
+        },
+    }
+
+# Реплики только для чтения: BLOG_DB_REPLICA_HOSTS=host1,host2. Остальные
+# параметры подключения как у default. В тестах реплики - зеркала default.
+BLOG_DB_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('BLOG_DB_REPLICA_HOSTS', '').split(',')), 1):
+    alias = 'replica_{}'.format(number)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip(),
+                            TEST={'MIRROR': 'default'})
+    BLOG_DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['blog.routers.PrimaryReplicaRouter']
 
+# Сколько секунд сессия читает с основной БД после записи
+BLOG_REPLICA_PIN_SECONDS = 300
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# По умолчанию кэш в памяти процесса (разработка и тесты). В продакшене
+# нужен общий для всех процессов бэкенд, иначе сброс версии кэша будет
+# виден только одному процессу, например:
+# BLOG_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+# BLOG_CACHE_LOCATION=127.0.0.1:11211
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('BLOG_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('BLOG_CACHE_LOCATION', 'blog'),
     }
 }
 
+# Алиас кэша для данных блога и время жизни записей в секундах
+BLOG_CACHE_ALIAS = 'default'
+BLOG_CACHE_TIMEOUT = 60 * 60
+# Время жизни страниц в кэше для анонимных читателей. Оно же ограничивает
+# устаревание боковой панели на закэшированных страницах
+BLOG_PAGE_CACHE_TIMEOUT = 5 * 60
+# Подсказки поиска кэшируются ненадолго и не сбрасываются при изменениях
+BLOG_SUGGEST_CACHE_TIMEOUT = 60
+# Найденные id статей по нормализованному запросу; сбрасываются при
+# изменении статей
+BLOG_SEARCH_CACHE_TIMEOUT = 10 * 60
+
+
+# Instrumentation
+# Количество запросов, время SQL и шаблонов для каждого запроса в
+# заголовке Server-Timing и логгере blog.perf
+BLOG_INSTRUMENTATION = os.environ.get('BLOG_INSTRUMENTATION', '1') == '1'
+# Сколько самых медленных SQL запросов запоминать и с какого времени
+# ответа (в мс) выводить их в лог
+BLOG_SLOW_QUERY_COUNT = 3
+BLOG_SLOW_REQUEST_MS = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # INFO - строка на каждый запрос, WARNING - только медленные запросы
+        'blog.perf': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -126,6 +227,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+# Сюда collectstatic собирает файлы, их отдает WhiteNoiseMiddleware
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# Без DEBUG collectstatic добавляет к именам файлов хэш содержимого и
+# заранее сжимает их в .gz и .br (Brotli). Файлы с хэшем отдаются с
+# Cache-Control: max-age=315360000, public, immutable. В разработке
+# файлы берутся из приложений без сборки.
+if not DEBUG:
+    STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 #wasturina.ekatterina@gmail.com
 # EMAIL_HOST = 'smtp.mail.ru'
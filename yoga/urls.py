@@ -15,13 +15,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.contrib.sitemaps.views import sitemap
-from blog.sitemaps import PostSitemap
-
-sitemaps = {'posts': PostSitemap}
+from blog.sitemaps import sitemap_index, sitemap_section
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap')
+    path('api/v1/', include('blog.api_urls', namespace='api_v1')),
+    path('sitemap.xml', sitemap_index, name='sitemap_index'),
+    path('sitemap-posts-<int:year>-<int:month>.xml', sitemap_section,
+         name='sitemap_section'),
 ]